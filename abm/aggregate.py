@@ -0,0 +1,180 @@
+from dataclasses import dataclass, field
+import numpy as np
+
+
+# (record attribute, column name) pairs, in the order of aggregate_sim_data.csv
+CSV_COLUMNS = [
+    ("simulation_name", "simulation_name"),
+    ("run_number", "run_number"),
+    ("prosumers", "prosumers"),
+    ("perfect_forecasting", "perfect_forecasting"),
+    ("exchange_type", "exchange_type"),
+    ("amm_liquidity_k", "amm_liquidity_k"),
+    ("total_overproduction", "Total Overproduction"),
+    ("total_shortfall", "Total Shortfall"),
+    ("total_bought", "Total Bought"),
+    ("total_bought_expenditure", "Total Bought Expenditure"),
+    ("total_over_bought", "Total Over Bought"),
+    ("total_under_bought", "Total Under Bought"),
+    ("total_sold", "Total Sold"),
+    ("total_sold_revenue", "Total Sold Revenue"),
+    ("total_daytime_demand", "Total Daytime Demand"),
+    ("total_production", "Total Production"),
+    ("total_production_for_demand", "Total Production for Demand"),
+    ("total_production_for_market", "Total Production for Market"),
+    ("total_production_for_utility", "Total Production for Utility"),
+    ("running_energy_sold", "Running Energy Sold"),
+    ("running_actual_production", "Running Actual Production"),
+    ("seller_average_price", "Seller Average Price"),
+    ("proportion_to_market", "Proportion of Total Production Sold into Market"),
+    ("proportion_excess_sold", "Proportion of Excess Sold into Market"),
+    ("total_system_demand", "Total System Demand"),
+    ("total_system_production", "Total System Production"),
+]
+
+CSV_HEADER = [column for _, column in CSV_COLUMNS]
+
+
+@dataclass
+class AggregateRecord:
+    """
+    Aggregate results of one simulation run. The scalar fields listed in
+    CSV_COLUMNS make up one row of aggregate_sim_data.csv, the remaining fields
+    are kept for analysis.
+    """
+    simulation_name: str
+    run_number: int
+    prosumers: int
+    perfect_forecasting: bool
+    exchange_type: str
+    amm_liquidity_k: object
+
+    total_overproduction: float
+    total_shortfall: float
+    total_bought: float
+    total_bought_expenditure: float
+    total_over_bought: float
+    total_under_bought: float
+    total_sold: float
+    total_sold_revenue: float
+    total_daytime_demand: float
+    total_production: float
+    total_production_for_demand: float
+    total_production_for_market: float
+    total_production_for_utility: float
+    running_energy_sold: float
+    running_actual_production: float
+    seller_average_price: float
+    proportion_to_market: float
+    proportion_excess_sold: float
+    total_system_demand: float
+    total_system_production: float
+
+    total_monthly_demand: float = 0.0
+    total_monthly_excess: float = 0.0
+    interval_average_seller_price: np.ndarray = field(default=None, repr=False)
+    running_average_seller_price: np.ndarray = field(default=None, repr=False)
+
+    def csv_row(self):
+        """
+        Returns the record as a list ordered like CSV_HEADER.
+        """
+        return [getattr(self, name) for name, _ in CSV_COLUMNS]
+
+    def as_dict(self):
+        """
+        Returns the CSV columns of the record as a {column name: value} dict.
+        """
+        return {column: getattr(self, name) for name, column in CSV_COLUMNS}
+
+
+def reduce_aggregates(ledger, has_pv, demand, production, production_for_demand,
+                      production_for_market, production_for_utility,
+                      retail_rate, avoided_fuel_cost_rate, sold_energy_cap=10000.0, **run_info):
+    """
+    Computes every aggregate written to aggregate_sim_data.csv with array
+    reductions over the ledger and the (houses, increments) household matrices.
+
+    INPUT:
+        ledger (TradeLedger): ledger of a finished and tallied run
+        has_pv (np arr of bool): (houses,) prosumer flags
+        demand, production, production_for_demand, production_for_market,
+        production_for_utility (np arr): (houses, increments) kWh matrices
+        retail_rate, avoided_fuel_cost_rate (float): $/kWh rates
+        sold_energy_cap (float): per house, per increment sales above this value
+                                 are treated as outliers and left out of the
+                                 running energy and seller price series
+        **run_info: simulation_name, run_number, prosumers, perfect_forecasting,
+                    exchange_type and amm_liquidity_k of the run
+
+    RETURN:
+        record (AggregateRecord)
+    """
+    sold = ledger["sold"]
+    sold_revenue = ledger["sold_revenue"]
+    overproduction = ledger["overproduction"]
+    shortfall = ledger["shortfall"]
+    excess_solar = ledger["excess_solar"]
+
+    totals = ledger.totals()
+    total_op = totals["overproduction"]
+    total_sf = totals["shortfall"]
+
+    total_production = np.sum(production)
+    total_production_for_market = np.sum(production_for_market)
+    total_production_for_utility = np.sum(production_for_utility)
+    excess_to_sell = total_production_for_market + total_production_for_utility
+
+    seller_avg_price = (totals["sold_revenue"] - (total_sf * retail_rate) + (total_op * avoided_fuel_cost_rate)) / excess_to_sell
+    proportion_to_market = total_production_for_market / total_production
+    proportion_excess_sold = total_production_for_market / excess_to_sell
+
+    # Per increment series, sales above the cap are left out
+    counted = sold <= sold_energy_cap
+    interval_energy = np.sum(np.where(counted, sold, 0.0), axis=0)
+    interval_revenue = np.sum(np.where(counted, sold_revenue, 0.0), axis=0)
+    interval_op = np.sum(overproduction, axis=0)
+    interval_sf = np.sum(shortfall, axis=0)
+    interval_excess = np.sum(excess_solar, axis=0)
+
+    interval_value = interval_revenue - (interval_sf * retail_rate) + (interval_op * avoided_fuel_cost_rate)
+    running_value = np.cumsum(interval_revenue) - (np.cumsum(interval_sf) * retail_rate) + (np.cumsum(interval_op) * avoided_fuel_cost_rate)
+    running_excess = np.cumsum(interval_excess)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        interval_average_seller_price = np.where(interval_excess > 0, interval_value / interval_excess, 0.0)
+        running_average_seller_price = np.where(running_excess > 0, running_value / running_excess, 0.0)
+
+    return AggregateRecord(
+        simulation_name=run_info.get("simulation_name"),
+        run_number=run_info.get("run_number"),
+        prosumers=run_info.get("prosumers"),
+        perfect_forecasting=run_info.get("perfect_forecasting"),
+        exchange_type=run_info.get("exchange_type"),
+        amm_liquidity_k=run_info.get("amm_liquidity_k"),
+        total_overproduction=total_op,
+        total_shortfall=total_sf,
+        total_bought=totals["bought"],
+        total_bought_expenditure=totals["bought_expenditure"],
+        total_over_bought=totals["overbought"],
+        total_under_bought=totals["underbought"],
+        total_sold=totals["sold"],
+        total_sold_revenue=totals["sold_revenue"],
+        total_daytime_demand=totals["daytime_demand"],
+        total_production=float(total_production),
+        total_production_for_demand=float(np.sum(production_for_demand)),
+        total_production_for_market=float(total_production_for_market),
+        total_production_for_utility=float(total_production_for_utility),
+        running_energy_sold=float(np.sum(interval_energy)),
+        running_actual_production=float(np.sum(production[has_pv])),
+        seller_average_price=float(seller_avg_price),
+        proportion_to_market=float(proportion_to_market),
+        proportion_excess_sold=float(proportion_excess_sold),
+        total_system_demand=float(np.sum(demand)),
+        total_system_production=float(np.sum(production[has_pv])),
+        total_monthly_demand=float(np.sum(demand)),
+        total_monthly_excess=totals["excess_solar"],
+        interval_average_seller_price=interval_average_seller_price,
+        running_average_seller_price=running_average_seller_price,
+    )
+
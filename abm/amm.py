@@ -1,6 +1,67 @@
+import math
+
 import numpy as np 
 
 
+# Order sides of the batched pool interfaces, a buy takes y tokens out of the 
+# pool and a sell puts x tokens into it 
+BUY = 1
+SELL = -1
+
+
+# Numeric token ids of the LeanAMM
+TOKEN_X = 0
+TOKEN_Y = 1
+
+
+def _execute_batch(reserve_x, reserve_y, k, gamma, sides, quantities, limits):
+    """
+    Swap loop of the execute_batch() methods, on plain floats. Returns fills,
+    amounts, accepted and the reserves and constant product after the batch.
+    """
+    quantities = np.asarray(quantities, dtype=float)
+    accepted = np.zeros(len(quantities), dtype=bool)
+    amounts = np.zeros(len(quantities))
+
+    for j, (side, quantity, limit) in enumerate(zip(np.asarray(sides).tolist(), quantities.tolist(),
+                                                     np.asarray(limits, dtype=float).tolist())):
+        if side == BUY:
+            x_needed = reserve_x - k/(reserve_y + quantity*gamma)
+            if x_needed <= limit:
+                reserve_x = reserve_x + x_needed
+                reserve_y = reserve_y - quantity
+                k = reserve_x*reserve_y
+                accepted[j] = True
+                amounts[j] = x_needed
+        else:
+            y_returned = reserve_y - k/(reserve_x + quantity*gamma)
+            if y_returned >= limit:
+                reserve_x = reserve_x + quantity
+                reserve_y = reserve_y - y_returned
+                k = reserve_x*reserve_y
+                accepted[j] = True
+                amounts[j] = y_returned
+
+    fills = np.where(accepted, quantities, 0.0)
+    return fills, amounts, accepted, reserve_x, reserve_y, k
+
+
+def liquidity_reserves(equilibrium_price, k):
+    """
+    Reserves an hour's pool starts with, so that its price in x per y equals the
+    equilibrium price and reserve_x * reserve_y equals k. Works elementwise on
+    arrays.
+
+    RETURN:
+        x_token_amt, y_token_amt
+    """
+    y_token_amt = np.sqrt(k/equilibrium_price)
+
+    x_token_amt = y_token_amt * equilibrium_price
+
+    return x_token_amt, y_token_amt
+
+
 class AMM(object):
     """
     Uniswap Automated Market Maker.
@@ -580,6 +641,31 @@ class AMM(object):
                  f"Total pool tokens :{self.lp_tokens}")
         
             
+    def execute_batch(self, sides, quantities, limits):
+        """
+        Processes an ordered batch of orders in one call. A BUY order buys 
+        quantity y tokens if it costs at most limit x tokens, like 
+        buy_tokens_max_price(token='y'), a SELL order sells quantity x tokens if 
+        it returns at least limit y tokens, like sell_tokens_min_price(token='x'). 
+        Every order sees the reserves the orders before it left, rejected orders 
+        do not change them. Nothing is printed and no dicts are built per order. 
+
+        INPUT: 
+            sides (np arr of int): BUY or SELL per order
+            quantities (np arr): tokens bought or sold per order
+            limits (np arr): max price of a buy / min price of a sell, for the 
+                             whole quantity
+        RETURN: 
+            fills (np arr): quantity filled per order, 0 if rejected
+            amounts (np arr): x tokens paid by a buy or y tokens received by a 
+                              sell, 0 if rejected
+            accepted (np arr of bool): whether each order was filled
+            reserve_x, reserve_y (float): reserves after the batch
+        """
+        fills, amounts, accepted, self.reserve_x, self.reserve_y, self.constant_product = _execute_batch(
+            self.reserve_x, self.reserve_y, self.constant_product, 1 - self.transaction_fee, sides, quantities, limits)
+        return fills, amounts, accepted, self.reserve_x, self.reserve_y
+
     def set_transaction_fee(self, transaction_fee):
         """
         sets the transaction fee of the uniswap institution to the specified amount
@@ -590,3 +676,232 @@ class AMM(object):
 
     
 
+
+
+class LeanAMM(object):
+    """
+    Allocation free version of the AMM for production runs. The state lives in
+    __slots__, tokens are the numeric TOKEN_X / TOKEN_Y, swaps return
+    (accepted, amount) tuples instead of dicts and "NoTrade" strings, nothing
+    is printed and gamma is computed once per fee instead of per request. A
+    pool is reset with setup_pool(), so one instance can serve every hour of
+    a run. The prices and reserve updates are those of the AMM, including the
+    formulas of its buy_tokens_max_price(token='y'), so a run gives the same
+    results with either class. InstrumentedAMM adds the debug prints.
+    """
+    __slots__ = ("reserve_x", "reserve_y", "constant_product", "lp_tokens", "transaction_fee", "gamma")
+
+    def __init__(self, transaction_fee=0):
+
+        self.reserve_x = 0.0
+        self.reserve_y = 0.0
+        self.constant_product = 0.0
+        self.lp_tokens = 0.0
+        self.transaction_fee = transaction_fee
+        self.gamma = 1 - transaction_fee
+
+    def set_transaction_fee(self, transaction_fee):
+        self.transaction_fee = transaction_fee
+        self.gamma = 1 - transaction_fee
+
+    def setup_pool(self, quantity_x=0, quantity_y=0):
+        """
+        (Re)establishes the pool with constant_product = quantity_x * quantity_y
+        and returns the liquidity tokens minted.
+        """
+        self.reserve_x = float(quantity_x)
+        self.reserve_y = float(quantity_y)
+        self.constant_product = self.reserve_x*self.reserve_y
+        self.lp_tokens = math.sqrt(self.constant_product)
+        return self.lp_tokens
+
+    def request_price(self, side, token, quantity):
+        """
+        x (for token y) or y (for token x) tokens a BUY of quantity costs or a
+        SELL of quantity returns, see AMM.request_price().
+        """
+        if side == BUY:
+            if token == TOKEN_X:
+                return (self.constant_product/(self.reserve_x - quantity) - self.reserve_y)/self.gamma
+            return (self.constant_product/(self.reserve_y - quantity) - self.reserve_x)/self.gamma
+        if token == TOKEN_X:
+            return self.reserve_y - self.constant_product/(self.reserve_x + quantity*self.gamma)
+        return self.reserve_x - self.constant_product/(self.reserve_y + quantity*self.gamma)
+
+    def buy_max_price(self, token, quantity, max_price):
+        """
+        Buys quantity of token if it costs at most max_price of the other
+        token, see AMM.buy_tokens_max_price().
+
+        RETURN:
+            accepted (bool), amount (float): tokens paid, 0.0 if rejected
+        """
+        if token == TOKEN_X:
+            y_needed = self.request_price(BUY, TOKEN_X, quantity)
+            if y_needed > max_price:
+                return False, 0.0
+            self.reserve_x = self.reserve_x - quantity
+            self.reserve_y = self.reserve_y + y_needed
+            self.constant_product = self.reserve_x*self.reserve_y
+            return True, y_needed
+
+        #priced like AMM.buy_tokens_max_price(token='y')
+        x_needed = self.request_price(SELL, TOKEN_Y, quantity)
+        if x_needed > max_price:
+            return False, 0.0
+        self.reserve_x = self.reserve_x + x_needed
+        self.reserve_y = self.reserve_y - quantity
+        self.constant_product = self.reserve_x*self.reserve_y
+        return True, x_needed
+
+    def sell_min_price(self, token, quantity, min_price):
+        """
+        Sells quantity of token if it returns at least min_price of the other
+        token, see AMM.sell_tokens_min_price().
+
+        RETURN:
+            accepted (bool), amount (float): tokens received, 0.0 if rejected
+        """
+        if token == TOKEN_X:
+            y_returned = self.request_price(SELL, TOKEN_X, quantity)
+            if y_returned < min_price:
+                return False, 0.0
+            self.reserve_x = self.reserve_x + quantity
+            self.reserve_y = self.reserve_y - y_returned
+            self.constant_product = self.reserve_x*self.reserve_y
+            return True, y_returned
+
+        x_returned = self.request_price(SELL, TOKEN_Y, quantity)
+        if x_returned < min_price:
+            return False, 0.0
+        self.reserve_x = self.reserve_x - x_returned
+        self.reserve_y = self.reserve_y + quantity
+        self.constant_product = self.reserve_x*self.reserve_y
+        return True, x_returned
+
+    def execute_batch(self, sides, quantities, limits):
+        """
+        Ordered batch of BUY (token y) / SELL (token x) orders, see AMM.execute_batch().
+
+        RETURN:
+            fills, amounts, accepted (np arr), reserve_x, reserve_y (float)
+        """
+        fills, amounts, accepted, self.reserve_x, self.reserve_y, self.constant_product = _execute_batch(
+            self.reserve_x, self.reserve_y, self.constant_product, self.gamma, sides, quantities, limits)
+        return fills, amounts, accepted, self.reserve_x, self.reserve_y
+
+
+class InstrumentedAMM(LeanAMM):
+    """
+    LeanAMM that prints the pool before and after every operation and every
+    rejected order, the debug output of the AMM without its branches in the
+    lean swap path.
+    """
+    __slots__ = ()
+
+    def _print_state(self, title):
+        print(f"-"*10, title, f"-"*10)
+        print(f"Reserve X:{self.reserve_x}\n"+
+              f"Reserve Y:{self.reserve_y}\n" +
+              f"k : {self.constant_product}\n")
+
+    def setup_pool(self, quantity_x=0, quantity_y=0):
+        lp_minted = super().setup_pool(quantity_x, quantity_y)
+        self._print_state("SETUP POOL")
+        return lp_minted
+
+    def buy_max_price(self, token, quantity, max_price):
+        self._print_state(f"BUY TOKEN = {token}, BEFORE TRADE")
+        accepted, amount = super().buy_max_price(token, quantity, max_price)
+        if accepted:
+            self._print_state(f"BUY TOKEN = {token}, AFTER TRADE")
+        else:
+            print(f"BUY TOKEN = {token}, FAILED: price {self.request_price(BUY if token == TOKEN_X else SELL, token, quantity)} > max_price = {max_price}")
+        return accepted, amount
+
+    def sell_min_price(self, token, quantity, min_price):
+        self._print_state(f"SELL TOKEN = {token}, BEFORE TRADE")
+        accepted, amount = super().sell_min_price(token, quantity, min_price)
+        if accepted:
+            self._print_state(f"SELL TOKEN = {token}, AFTER TRADE")
+        else:
+            print(f"SELL TOKEN = {token}, FAILED: returned {self.request_price(SELL, token, quantity)} < min_price = {min_price}")
+        return accepted, amount
+
+    def execute_batch(self, sides, quantities, limits):
+        self._print_state(f"BATCH OF {len(quantities)} ORDERS, BEFORE")
+        fills, amounts, accepted, reserve_x, reserve_y = super().execute_batch(sides, quantities, limits)
+        for j in np.flatnonzero(~accepted):
+            print(f"order {j}: side = {sides[j]}, quantity = {quantities[j]}, limit = {limits[j]} REJECTED")
+        self._print_state(f"BATCH OF {len(quantities)} ORDERS, AFTER")
+        return fills, amounts, accepted, reserve_x, reserve_y
+
+
+# AMM classes a run can use, config key amm_implementation
+AMM_IMPLEMENTATIONS = {
+    "lean": LeanAMM,
+    "instrumented": InstrumentedAMM,
+    "teaching": AMM,
+}
+
+
+class ScenarioPools(object):
+    """
+    S independent constant product pools, one per scenario, that see the same
+    order flow. The reserves, constant products and fees are (S,) arrays and
+    every order is applied to all S pools at once, with the same arithmetic as
+    the AMM.buy_tokens_max_price(token='y') and AMM.sell_tokens_min_price(token='x')
+    calls of Market.amm_swaps(), so scenario s fills exactly what an AMM with
+    its liquidity and fee would.
+    """
+    def __init__(self, transaction_fee):
+
+        self.transaction_fee = np.asarray(transaction_fee, dtype=float)
+        self.gamma = 1 - self.transaction_fee
+
+        self.reserve_x = np.zeros(self.transaction_fee.shape)
+        self.reserve_y = np.zeros(self.transaction_fee.shape)
+        self.constant_product = np.zeros(self.transaction_fee.shape)
+
+    def setup_pools(self, quantity_x, quantity_y):
+        """
+        Establishes every pool with constant_product = quantity_x * quantity_y,
+        quantity_x and quantity_y are (S,) arrays.
+        """
+        self.reserve_x = np.array(quantity_x, dtype=float)
+        self.reserve_y = np.array(quantity_y, dtype=float)
+        self.constant_product = self.reserve_x*self.reserve_y
+
+    def buy_y_max_price(self, quantity, max_price):
+        """
+        An order buying quantity y tokens for at most max_price x tokens,
+        see AMM.buy_tokens_max_price(token='y').
+
+        RETURN:
+            accepted (np arr of bool): (S,) pools that filled the order
+            x_needed (np arr): (S,) x tokens paid in each pool
+        """
+        x_needed = self.reserve_x - self.constant_product/(self.reserve_y + quantity*self.gamma)
+        accepted = x_needed <= max_price
+
+        self.reserve_x = np.where(accepted, self.reserve_x + x_needed, self.reserve_x)
+        self.reserve_y = np.where(accepted, self.reserve_y - quantity, self.reserve_y)
+        self.constant_product = np.where(accepted, self.reserve_x*self.reserve_y, self.constant_product)
+        return accepted, x_needed
+
+    def sell_x_min_price(self, quantity, min_price):
+        """
+        An order selling quantity x tokens for at least min_price y tokens,
+        see AMM.sell_tokens_min_price(token='x').
+
+        RETURN:
+            accepted (np arr of bool): (S,) pools that filled the order
+            y_returned (np arr): (S,) y tokens returned by each pool
+        """
+        y_returned = self.reserve_y - self.constant_product/(self.reserve_x + quantity*self.gamma)
+        accepted = y_returned >= min_price
+
+        self.reserve_x = np.where(accepted, self.reserve_x + quantity, self.reserve_x)
+        self.reserve_y = np.where(accepted, self.reserve_y - y_returned, self.reserve_y)
+        self.constant_product = np.where(accepted, self.reserve_x*self.reserve_y, self.constant_product)
+        return accepted, y_returned
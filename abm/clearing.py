@@ -0,0 +1,140 @@
+import numpy as np
+
+
+def _prepare_curves(prices, quantities):
+    """
+    Sorts each row of a batch of piecewise-linear curves by price and removes
+    repeated prices, keeping the knot with the largest cumulative quantity
+    (the last one in stable sorted order, as interp1d would). Missing knots
+    are nan and end up at the back of each row.
+
+    RETURN:
+        prices, quantities (np arr): (rows, knots) compacted curves
+        counts (np arr of int): number of valid knots per row
+    """
+    order = np.argsort(prices, axis=1, kind="stable")
+    prices = np.take_along_axis(prices, order, axis=1)
+    quantities = np.take_along_axis(quantities, order, axis=1)
+
+    valid = ~np.isnan(prices)
+    valid[:, :-1] &= prices[:, :-1] != prices[:, 1:]
+
+    #move the valid knots to the front, keeping their order
+    order = np.argsort(~valid, axis=1, kind="stable")
+    prices = np.where(np.take_along_axis(valid, order, axis=1), np.take_along_axis(prices, order, axis=1), np.nan)
+    quantities = np.take_along_axis(quantities, order, axis=1)
+    return prices, quantities, valid.sum(axis=1)
+
+
+def _evaluate(prices, quantities, counts, points):
+    """
+    Evaluates a batch of curves at points (rows, points), interpolating
+    linearly between the knots and extrapolating the first and last segments
+    beyond them. Rows with fewer than two knots evaluate to nan.
+    """
+    rows = np.arange(prices.shape[0])[:, None]
+    knots = prices.shape[1]
+
+    #segment of a point: the number of knots <= it, minus one. The knots and
+    #points of each row are sorted together, a stable sort puts a knot before
+    #a point of equal price and every nan last, so the running count of knots
+    #at a point's position is its count, in (rows, knots + points) memory
+    order = np.argsort(np.concatenate([prices, points], axis=1), axis=1, kind="stable")
+    knots_before = np.empty_like(order)
+    np.put_along_axis(knots_before, order, np.cumsum(order < knots, axis=1), axis=1)
+    segment = knots_before[:, knots:] - 1
+    segment = np.clip(segment, 0, np.maximum(counts - 2, 0)[:, None])
+
+    x_lo = prices[rows, segment]
+    y_lo = quantities[rows, segment]
+    next_segment = np.minimum(segment + 1, prices.shape[1] - 1)
+    x_hi = prices[rows, next_segment]
+    y_hi = quantities[rows, next_segment]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = y_lo + (points - x_lo) * (y_hi - y_lo) / (x_hi - x_lo)
+    values[counts < 2] = np.nan
+    return values
+
+
+def clearing_prices(demand_price, demand_quantity, supply_price, supply_quantity, guess=None):
+    """
+    Finds, in closed form, the prices where cumulative demand equals cumulative
+    supply for many hours at once. Both curves are piecewise linear through
+    their knots and extrapolated linearly beyond them, the semantics of
+    interp1d(kind='linear', fill_value="extrapolate"), so their difference is
+    linear between the union of the knots and each crossing is found exactly
+    on one of those segments.
+
+    INPUT:
+        demand_price, demand_quantity (np arr): (hours, buyers) WTP of the
+            ordered buyers and their cumulative demand, padded with nan
+        supply_price, supply_quantity (np arr): (hours, sellers) WTA of the
+            ordered sellers and their cumulative supply, padded with nan
+        guess (np arr): (hours,) if several prices clear an hour, the one
+            closest to guess is returned, defaults to the mean demand price
+    RETURN:
+        prices (np arr): (hours,) clearing prices, nan where the curves do not
+                         cross or a curve has fewer than two distinct prices
+    """
+    demand_price = np.atleast_2d(np.asarray(demand_price, dtype=float))
+    demand_quantity = np.atleast_2d(np.asarray(demand_quantity, dtype=float))
+    supply_price = np.atleast_2d(np.asarray(supply_price, dtype=float))
+    supply_quantity = np.atleast_2d(np.asarray(supply_quantity, dtype=float))
+    if guess is None:
+        guess = np.nanmean(demand_price, axis=1)
+    guess = np.broadcast_to(np.asarray(guess, dtype=float), demand_price.shape[:1])
+
+    d_price, d_quantity, d_count = _prepare_curves(demand_price, demand_quantity)
+    s_price, s_quantity, s_count = _prepare_curves(supply_price, supply_quantity)
+
+    def excess_demand(points):
+        return (_evaluate(d_price, d_quantity, d_count, points)
+                - _evaluate(s_price, s_quantity, s_count, points))
+
+    #the difference of the curves is linear between consecutive grid prices
+    grid = np.sort(np.concatenate([d_price, s_price], axis=1), axis=1)
+    first = grid[:, :1]
+    last = np.nanmax(grid, axis=1, keepdims=True)
+    values = excess_demand(grid)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        #crossings inside a segment, or at its left knot
+        left_value, right_value = values[:, :-1], values[:, 1:]
+        left_price, right_price = grid[:, :-1], grid[:, 1:]
+        crosses = (left_value * right_value <= 0) & (right_price > left_price)
+        inner = np.where(left_value == right_value, left_price,
+                         left_price - left_value * (right_price - left_price) / (right_value - left_value))
+        inner = np.where(crosses, inner, np.nan)
+
+        #crossings on the extrapolated ends, beyond every knot
+        first_value = excess_demand(first)
+        last_value = excess_demand(last)
+        below = first - first_value / (first_value - excess_demand(first - 1.0))
+        above = last - last_value / (excess_demand(last + 1.0) - last_value)
+        below = np.where(np.isfinite(below) & (below <= first), below, np.nan)
+        above = np.where(np.isfinite(above) & (above >= last), above, np.nan)
+
+    candidates = np.concatenate([below, inner, above], axis=1)
+    distance = np.abs(candidates - guess[:, None])
+    found = ~np.all(np.isnan(candidates), axis=1)
+    best = np.argmin(np.where(np.isnan(distance), np.inf, distance), axis=1)
+    prices = candidates[np.arange(candidates.shape[0]), best]
+    return np.where(found, prices, np.nan)
+
+
+def clearing_price(demand_price, demand_quantity, supply_price, supply_quantity, guess=None):
+    """
+    Clearing price of a single hour, see clearing_prices().
+
+    INPUT:
+        demand_price, demand_quantity (np arr): WTP of the ordered buyers and
+                                                their cumulative demand
+        supply_price, supply_quantity (np arr): WTA of the ordered sellers and
+                                                their cumulative supply
+        guess (float): preferred price if several prices clear the market
+    RETURN:
+        price (float): clearing price, nan if there is none
+    """
+    return float(clearing_prices(demand_price, demand_quantity, supply_price, supply_quantity,
+                                 None if guess is None else [guess])[0])
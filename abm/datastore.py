@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# Bump when the conversion below changes, older .npy files are then rebuilt
+CACHE_VERSION = 1
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'cons_prod_data'))
+
+# The data files a run reads, their digests are part of the run cache keys
+INPUT_DATA_FILES = ("hourly_consumption", "production_monthly_minutely")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Returns the sha256 hex digest of the file at path.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def cache_paths(filename, data_dir=DATA_DIR):
+    """
+    Returns the (csv, npy, metadata) paths of a data file. The binary copy is
+    stored beside the csv and versioned with CACHE_VERSION.
+    """
+    csv_path = os.path.join(data_dir, f'{filename}.csv')
+    npy_path = os.path.join(data_dir, f'{filename}.v{CACHE_VERSION}.npy')
+    meta_path = npy_path + '.json'
+    return csv_path, npy_path, meta_path
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path, 'r') as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_atomic(path, write):
+    """
+    Writes through a temporary file that is renamed into place, so concurrent
+    workers never see a partially written file.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _write_meta(meta_path, meta):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file, indent=4)
+    _write_atomic(meta_path, write)
+
+
+def convert(filename, data_dir=DATA_DIR):
+    """
+    Parses the csv once with pandas and stores its (single) data column as a
+    float64 .npy file next to it, together with a metadata file recording the
+    source's mtime, size and sha256.
+
+    RETURN:
+        meta (dict): the metadata that was written
+    """
+    csv_path, npy_path, meta_path = cache_paths(filename, data_dir)
+    stat = os.stat(csv_path)
+
+    data = pd.read_csv(csv_path)
+    values = np.ascontiguousarray(data.iloc[:, 0].to_numpy(dtype=np.float64))
+
+    def write(tmp_path):
+        with open(tmp_path, 'wb') as npy_file:
+            np.save(npy_file, values)
+    _write_atomic(npy_path, write)
+
+    meta = {"version": CACHE_VERSION,
+            "source": os.path.basename(csv_path),
+            "column": str(data.columns[0]).lstrip('\ufeff'),
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_digest(csv_path),
+            "length": int(values.shape[0])}
+    _write_meta(meta_path, meta)
+    return meta
+
+
+def ensure_cached(filename, data_dir=DATA_DIR):
+    """
+    Makes sure the binary copy of a data file is up to date and returns its
+    metadata. The copy is trusted while the source's mtime and size are
+    unchanged. Otherwise the source is hashed, and it is only reconverted if
+    its content actually changed.
+    """
+    csv_path, npy_path, meta_path = cache_paths(filename, data_dir)
+    stat = os.stat(csv_path)
+    meta = _read_meta(meta_path)
+
+    if meta is None or meta.get("version") != CACHE_VERSION or not os.path.isfile(npy_path):
+        return convert(filename, data_dir)
+
+    if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+        return meta
+
+    if file_digest(csv_path) == meta["sha256"]:
+        #touched but not changed, only refresh the recorded mtime
+        meta["mtime_ns"] = stat.st_mtime_ns
+        meta["size"] = stat.st_size
+        _write_meta(meta_path, meta)
+        return meta
+
+    return convert(filename, data_dir)
+
+
+def load_data_array(filename, data_dir=DATA_DIR):
+    """
+    Loads a data file from the data folder as a read-only, memory-mapped
+    float64 array, converting the csv on first use. Worker processes that load
+    the same file share one page-cached copy.
+
+    INPUT:
+        filename (str): the filename of the data file without the extension
+    RETURN:
+        data (np memmap): one dimensional read-only array
+    """
+    ensure_cached(filename, data_dir)
+    _, npy_path, _ = cache_paths(filename, data_dir)
+    return np.load(npy_path, mmap_mode='r')
+
+
+def data_digest(filename, data_dir=DATA_DIR):
+    """
+    Returns the sha256 of a data file's csv, as recorded in its cache metadata.
+    """
+    return ensure_cached(filename, data_dir)["sha256"]
+
+
+def preprocess_all(data_dir=DATA_DIR):
+    """
+    Converts every csv in the data folder to its binary copy.
+    """
+    converted = {}
+    for name in sorted(os.listdir(data_dir)):
+        if name.endswith('.csv'):
+            filename = name[:-len('.csv')]
+            converted[filename] = ensure_cached(filename, data_dir)
+    return converted
+
+
+if __name__ == "__main__":
+    for filename, meta in preprocess_all().items():
+        print(f"{filename}: {meta['length']} values, sha256 {meta['sha256'][:12]}")
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from abm.datastore import INPUT_DATA_FILES, data_digest
+
+
+DEFAULT_EQUILIBRIUM_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                        '..', 'simulation_output', 'equilibrium_cache'))
+
+# Arrays of an order book artifact, see Market.amm_order_books()
+ORDER_BOOK_FIELDS = ("hours", "equilibrium_price")
+
+
+class EquilibriumCache:
+    """
+    On-disk store of what the amm order books of a run clear to: the hours
+    with a market and their equilibrium prices. The swaps go in random bid
+    order, so the price ordered books themselves are not kept. The prices are
+    computed before any pool exists, so they depend on the
+    households and their forecasts but never on amm_liquidity_k or the fee,
+    and every run of a liquidity sweep can read them from one npz artifact.
+
+    The key covers the household params, the forecasting mode, the digests
+    of the input data and the model version. The trading forecasts come from
+    first-minute production, the forecast noise only feeds
+    solar_prod_forecast_increment, so neither the seed, the noise settings
+    nor the run number change the order books and one artifact serves every
+    run of a configuration.
+    """
+    def __init__(self, cache_dir=DEFAULT_EQUILIBRIUM_DIR):
+
+        self.cache_dir = cache_dir
+        self._input_digests = None
+
+    def input_digests(self):
+        if self._input_digests is None:
+            self._input_digests = {filename: data_digest(filename) for filename in INPUT_DATA_FILES}
+        return self._input_digests
+
+    def key(self, config, model_version):
+        """
+        Returns the sha256 key of the order books of config.
+        """
+        payload = {
+            "model_version": model_version,
+            "household_params": config["household_params"],
+            "perfect_forecasting": config["perfect_forecasting"],
+            "input_data": self.input_digests(),
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def get(self, key):
+        """
+        Returns the order books stored under key as {field: array}, None on a miss.
+        """
+        try:
+            with np.load(self._path(key)) as artifact:
+                return {name: artifact[name] for name in ORDER_BOOK_FIELDS}
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def put(self, key, order_books):
+        """
+        Stores order books under key.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as artifact_file:
+            np.savez(artifact_file, **{name: order_books[name] for name in ORDER_BOOK_FIELDS})
+        os.replace(tmp_path, path)
@@ -2,6 +2,100 @@ from scipy.stats import norm
 import numpy as np
 
 
+# Standard deviation of the relative solar forecast error
+FORECAST_NOISE_STD = 0.30
+
+
+class SharedProfile:
+    """ 
+    Minutely profile (W/h) shared by many households, each of which uses it 
+    scaled by its own factor (floor area for demand, roof area for production). 
+    A profile given at a coarser resolution, e.g. hourly values held for each 
+    of their 60 minutes, is stored as is with hold set to the number of minutes 
+    each value is held. 
+    """
+    def __init__(self, values, increment=60, hold=1):
+
+        self.values = np.asarray(values, dtype=float)
+        self.increment = increment
+        self.hold = hold
+        # increments with a positive value during any of their minutes
+        self.positive_increments = np.any(self.by_increment() > 0.0, axis=1)
+
+    def minutely_view(self, scale=None):
+        """ 
+        Returns the minutely series, scaled if scale is given. Held values are 
+        repeated over their minutes. 
+        """
+        values = self.values if scale is None else self.values * scale
+        if self.hold == 1:
+            return values
+        return np.broadcast_to(values[:, None], (len(values), self.hold)).reshape(-1)
+
+    def by_increment(self, scale=None):
+        """ 
+        Returns the (increments, minutes per increment) minutely series, a 
+        broadcast view without copies when values are held for whole increments. 
+        """
+        if self.hold == self.increment:
+            values = self.values if scale is None else self.values * scale
+            return np.broadcast_to(values[:, None], (len(values), self.hold))
+        return self.minutely_view(scale).reshape(-1, self.increment)
+
+    def scaled(self, scale):
+        return ScaledProfile(self, scale)
+
+
+class ScaledProfile:
+    """ 
+    Lazy, read-only view of scale * profile for one household. Indexing and 
+    arithmetic compute only what is asked for, np.asarray() materializes the 
+    whole minutely series. 
+    """
+    def __init__(self, shared, scale):
+
+        self.shared = shared
+        self.scale = float(scale)
+
+    def __array__(self, dtype=None, copy=None):
+        values = np.array(self.shared.minutely_view(self.scale))
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, index):
+        shared = self.shared
+        if shared.hold == 1:
+            return shared.values[index] * self.scale
+        minutes = np.arange(len(self))[index]
+        return shared.values[minutes // shared.hold] * self.scale
+
+    def __len__(self):
+        return len(self.shared.values) * self.shared.hold
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def __mul__(self, other):
+        return np.asarray(self) * other
+
+    __rmul__ = __mul__
+
+    def increment_totals(self):
+        """ 
+        kWh per increment of the scaled profile. The scaled minutely values are 
+        summed the same way as a materialized series would be, held values 
+        through a broadcast view, so no per house minutely array is kept. 
+        """
+        return np.sum(self.shared.by_increment(self.scale), axis=1) / 1000 / 60
+
+    def positive_increments(self):
+        if self.scale > 0:
+            return self.shared.positive_increments
+        if self.scale < 0:
+            return np.any(self.shared.by_increment() < 0.0, axis=1)
+        return np.zeros_like(self.shared.positive_increments)
+
+
 class Household:
     def __init__(self, index, has_pv, floor_area, wta, wtp, perfect_forecasting, run):
 
@@ -43,9 +137,15 @@ class Household:
         self.interest_rate = 0.07
         self.minimum_charge = 4.05
         self.maximum_charge = 13.5
-        self.electricity_use = np.zeros(self.minutes_month)
-        self.solar_prod = np.zeros(self.minutes_month)
-        self.solar_prod_forecast = np.zeros(self.minutes_month)
+        # Minutely series, read-only zero views until set_electricity_use() and 
+        # set_solar_production() give them a (usually shared, scaled) profile
+        self.electricity_use = np.broadcast_to(0.0, (self.minutes_month,))
+        self.solar_prod = np.broadcast_to(0.0, (self.minutes_month,))
+        # kWh per increment, precomputed once from the minutely data above
+        self.electricity_use_increment = np.zeros(self.number_increments)
+        self.solar_prod_increment = np.zeros(self.number_increments)
+        self.solar_prod_forecast_totals = np.zeros(self.number_increments)
+        self.daytime_increment = np.zeros(self.number_increments, dtype=bool)
         self.solar_prod_forecast_increment = np.zeros(self.number_increments)
         self.demand = np.zeros(self.number_increments)
         self.demand_after_storage_discharge = np.zeros(self.number_increments)
@@ -86,8 +186,25 @@ class Household:
     def calc_prod_20(self):
         self.expected_production_20 = self.expected_production * 20
 
+    def sum_increments(self, minutely):
+        """ 
+        Integrates minutely W/h data into kWh per increment with a single 
+        reshape and sum instead of slicing the minutely array every time a 
+        forecast is made. 
+
+        INPUT: 
+            minutely (np arr): minutely data of length minutes_month
+        RETURN: 
+            increment_totals (np arr): kWh of length number_increments
+        """
+        if isinstance(minutely, ScaledProfile):
+            return minutely.increment_totals()
+        minutely = np.asarray(minutely, dtype=float)
+        return np.sum(minutely.reshape(self.number_increments, self.increment), axis=1) / 1000 / 60
+
     def set_electricity_use(self, elec_use):
         self.electricity_use = elec_use
+        self.electricity_use_increment = self.sum_increments(elec_use)
 
     def get_wtp(self):
 
@@ -102,24 +219,31 @@ class Household:
 
     def set_solar_production(self, production):
         self.solar_prod = production
+        self.solar_prod_increment = self.sum_increments(production)
+        #An increment is daytime if the house produces during any of its minutes
+        if isinstance(production, ScaledProfile):
+            self.daytime_increment = production.positive_increments()
+        else:
+            self.daytime_increment = np.any(np.reshape(production, (self.number_increments, self.increment)) > 0.0, axis=1)
 
     def get_solar_production(self, minute):
         return self.solar_prod[minute]
 
     def set_forecasted_solar_production(self):
-        normal_dist = norm(0, 0.30) #scipy normal distribution object 
+        normal_dist = norm(0, FORECAST_NOISE_STD) #scipy normal distribution object 
         forecast_multiplier = normal_dist.rvs(size=self.minutes_month) + 1
-        self.solar_prod_forecast = self.solar_prod * forecast_multiplier
-
+        #only the per increment totals are kept, not the noisy minutely series
+        self.solar_prod_forecast_totals = self.sum_increments(self.solar_prod * forecast_multiplier)
 
-    def fill_solar_prod_forecast_increment(self):
-        for i in range(self.number_increments):
-            start_minute = i * self.increment
-            end_minute = start_minute + self.increment
-            if self.has_pv:
-                self.solar_prod_forecast_increment[i] = np.sum(self.solar_prod_forecast[start_minute:end_minute]) / 1000 / 60
-            else:
-                self.solar_prod_forecast_increment[i] = 0
+    def forecast_production_increment(self):
+        """ 
+        Production the household expects during the current increment, in kWh. 
+        """
+        if not self.has_pv:
+            return 0
+        if self.perfect_forecasting:
+            return self.solar_prod_increment[self.current_increment - 1]
+        return (self.solar_prod[self.current_minute] / 1000) * (self.increment / 60.0)
 
     def forecast_demand_no_storage_simple(self):
         """ 
@@ -128,20 +252,9 @@ class Household:
 
         #print(f"Household{self.index} Entered: forecast_demand_no_storage_simple current_minute = {self.current_minute}, current_increment = {self.current_increment}")
         
-        actual_demand = np.sum(self.electricity_use[self.current_minute:self.current_minute + self.increment]) / 1000 / 60
-        forecast_production = 0.0
-        #print(f"\tactual_demand: {actual_demand}")
-    
-        if self.perfect_forecasting:
-            forecast_production = np.sum(self.solar_prod[self.current_minute:self.current_minute + self.increment]) / 1000 / 60
-        else:
-            forecast_production = (self.solar_prod[self.current_minute] / 1000) * (self.increment / 60.0)
-        #print(f"\t perfect_forecasting = {self.perfect_forecasting}, forecast_production: {forecast_production} ")
-    
-        if not self.has_pv:
-            forecast_production = 0
-        
-        #print(f"\t has pv = {self.has_pv}, forecast_production = {forecast_production}")
+        actual_demand = self.electricity_use_increment[self.current_increment - 1]
+        forecast_production = self.forecast_production_increment()
+        #print(f"\tactual_demand: {actual_demand}, forecast_production: {forecast_production}")
 
         forecast_demand = max(actual_demand - forecast_production, 0)
 
@@ -156,19 +269,10 @@ class Household:
         
         """
         #print(f"Household{self.index} Entered: forecast_excess_no_storage_simple current_minute = {self.current_minute}, current_increment = {self.current_increment}")
-        actual_demand = np.sum(self.electricity_use[self.current_minute:self.current_minute + self.increment]) / 1000 / 60
-        forecast_production = 0.0
-        #print(f"\tactual_demand: {actual_demand}")
-        
-        if self.perfect_forecasting:
-            forecast_production = np.sum(self.solar_prod[self.current_minute:self.current_minute + self.increment]) / 1000 / 60
-        else:
-            forecast_production = (self.solar_prod[self.current_minute] / 1000) * (self.increment / 60.0)
-
-        #print(f"\t perfect_forecasting = {self.perfect_forecasting}, forecast_production: {forecast_production} ")
+        actual_demand = self.electricity_use_increment[self.current_increment - 1]
+        forecast_production = self.forecast_production_increment()
+        #print(f"\tactual_demand: {actual_demand}, forecast_production: {forecast_production}")
 
-        if not self.has_pv:
-            forecast_production = 0
         forecast_excess = max(forecast_production - actual_demand, 0)
         #print(f"\t has pv = {self.has_pv}, excess forecast - demand = {forecast_excess}")
 
@@ -177,16 +281,12 @@ class Household:
 
     def fill_solar_prod_forecast_increment(self):
         if self.current_increment == 1:
-            self.solar_prod_forecast_increment = np.zeros(self.number_increments)
-        
-        actual_production = 0.0
-        for i in range(self.increment):
-            if self.has_pv:
-                actual_production += (self.solar_prod_forecast[self.current_minute + i] / 1000.0) / 60.0
-            else: 
-                pass
+            self.solar_prod_forecast_increment[:] = 0.0
         
-        self.solar_prod_forecast_increment[self.current_increment - 1] = actual_production
+        if self.has_pv:
+            self.solar_prod_forecast_increment[self.current_increment - 1] = self.solar_prod_forecast_totals[self.current_increment - 1]
+        else:
+            self.solar_prod_forecast_increment[self.current_increment - 1] = 0.0
 
 
     def __str__(self):
@@ -195,11 +295,178 @@ class Household:
                 f"Floor Area: {self.floor_area} sqft, "
                 f"Willingness to Accept: ${self.wta:.2f}, "
                 f"Willingness to Pay: ${self.wtp:.2f})")
-    
 
 
+class HouseholdPopulation:
+    """
+    Struct-of-arrays container for a list of Household objects. Holds the per 
+    household parameters as arrays and the demand and production of every house 
+    as (houses, increments) kWh matrices, so the market can forecast, step and 
+    account for all houses with a handful of numpy calls instead of one method 
+    call per house. 
+
+    NOTE: the production matrices only count production of prosumers (has_pv), 
+    the same way the forecasts and tallies of the Household class do. 
+    """
+    def __init__(self, households):
+
+        self.households = list(households)
+        self.number_houses = len(self.households)
+
+        first = self.households[0]
+        self.increment = first.increment
+        self.number_increments = first.number_increments
+        self.current_minute = first.current_minute
+        self.current_increment = first.current_increment
+
+        self.index = np.array([household.index for household in self.households])
+        self.has_pv = np.array([household.has_pv for household in self.households], dtype=bool)
+        self.floor_area = np.array([household.floor_area for household in self.households], dtype=float)
+        self.roof_area = np.array([household.roof_area for household in self.households], dtype=float)
+        self.wta = np.array([household.wta for household in self.households], dtype=float)
+        self.wtp = np.array([household.wtp for household in self.households], dtype=float)
+        self.perfect_forecasting = np.array([household.perfect_forecasting for household in self.households], dtype=bool)
+
+        # Price priority of the order book, WTP and WTA are fixed for a run: 
+        # highest WTP buys first, lowest WTA sells first, ties by position
+        self.buyer_priority = np.argsort(-self.wtp, kind="stable")
+        self.seller_priority = np.argsort(self.wta, kind="stable")
+
+        # An increment is daytime if any prosumer produces during any of its minutes
+        daytime_increment = np.array([household.daytime_increment for household in self.households])
+        self.daytime = np.any(daytime_increment[self.has_pv], axis=0)
+
+        # Actual demand and production in kWh for every house and increment, 
+        # stacked from the households' precomputed increment totals
+        self.demand = np.array([household.electricity_use_increment for household in self.households])
+        self.production = np.array([household.solar_prod_increment for household in self.households])
+        self.production[~self.has_pv] = 0.0
+
+        # What the households expect to produce when they trade: the actual 
+        # production with perfect forecasting, otherwise the production of the 
+        # first minute of the increment held for the whole increment
+        first_minute = np.array([household.solar_prod[::self.increment] for household in self.households])
+        first_minute_production = (first_minute / 1000) * (self.increment / 60.0)
+        self.forecast_production = np.where(self.perfect_forecasting[:, None], self.production, first_minute_production)
+        self.forecast_production[~self.has_pv] = 0.0
+
+        self.forecast_demand_matrix = np.maximum(self.demand - self.forecast_production, 0)
+        self.forecast_excess_matrix = np.maximum(self.forecast_production - self.demand, 0)
+
+        # Increments where any house forecasts demand and any house forecasts 
+        # excess, on all others (every night) no exchange can trade
+        self.market_possible = (np.any(self.forecast_demand_matrix > 0, axis=0)
+                                & np.any(self.forecast_excess_matrix > 0, axis=0))
+
+        # Filled by Market.tally_op_sf_hh() at the end of a run
+        self.production_for_demand = np.zeros((self.number_houses, self.number_increments))
+        self.production_after_demand = np.zeros((self.number_houses, self.number_increments))
+        self.production_for_market = np.zeros((self.number_houses, self.number_increments))
+        self.production_for_utility = np.zeros((self.number_houses, self.number_increments))
+
+        # The per house arrays of the Household objects become rows of the matrices
+        for i, household in enumerate(self.households):
+            household.demand = self.demand[i]
+            household.production = self.production[i]
+            household.production_for_demand = self.production_for_demand[i]
+            household.production_after_demand = self.production_after_demand[i]
+            household.production_for_market = self.production_for_market[i]
+            household.production_for_utility = self.production_for_utility[i]
+
+        # Forecasted production per increment, revealed one increment at a time 
+        # by fill_solar_prod_forecast_increment()
+        self._forecast_production_totals = np.array([household.solar_prod_forecast_totals for household in self.households])
+        self._forecast_production_totals[~self.has_pv] = 0.0
+        self.solar_prod_forecast_increment = np.zeros((self.number_houses, self.number_increments))
+        for i, household in enumerate(self.households):
+            household.solar_prod_forecast_increment = self.solar_prod_forecast_increment[i]
+
+    def set_forecasted_production(self, rng, resolution="minutely", dtype=np.float64, chunk_houses=256):
+        """ 
+        Vectorized Household.set_forecasted_solar_production(). Draws the 
+        relative forecast error of every house from rng in bulk, (houses, minutes) 
+        or (houses, increments) at a time, and sets the noisy forecasted 
+        production per increment of every house. 
+
+        INPUT: 
+            rng (np.random.Generator): random generator of the run
+            resolution (str): "minutely" draws an error per minute, "hourly" one 
+                              per increment applied to the increment's total
+            dtype: float64, or float32 to halve the memory of the noise
+            chunk_houses (int): houses drawn at a time, bounds the memory of 
+                                minutely noise to chunk_houses * minutes
+        """
+        if resolution not in ("minutely", "hourly"):
+            raise ValueError(f"unknown forecast noise resolution {resolution!r}, expected 'minutely' or 'hourly'")
+
+        totals = np.zeros((self.number_houses, self.number_increments))
+        for start in range(0, self.number_houses, chunk_houses):
+            chunk = slice(start, min(start + chunk_houses, self.number_houses))
+            size = chunk.stop - chunk.start
+            if resolution == "hourly":
+                noise = rng.standard_normal((size, self.number_increments), dtype=dtype)
+                production = np.array([household.solar_prod_increment for household in self.households[chunk]], dtype=dtype)
+                totals[chunk] = production * (noise * FORECAST_NOISE_STD + 1)
+            else:
+                minutes = self.number_increments * self.increment
+                noise = rng.standard_normal((size, minutes), dtype=dtype)
+                production = np.array([np.asarray(household.solar_prod) for household in self.households[chunk]], dtype=dtype)
+                noisy = (production * (noise * FORECAST_NOISE_STD + 1)).reshape(size, self.number_increments, self.increment)
+                totals[chunk] = np.sum(noisy, axis=2) / 1000 / 60
+
+        totals[~self.has_pv] = 0.0
+        self._forecast_production_totals = totals
+        for i, household in enumerate(self.households):
+            household.solar_prod_forecast_totals = totals[i]
+
+    def forecast_demand(self, increment=None):
+        """ 
+        Vectorized Household.forecast_demand_no_storage_simple(). 
+
+        INPUT: 
+            increment (int): 0 based increment, defaults to the current one
+        RETURN: 
+            forecast_demand (np arr): (houses,) forecasted demand in kWh
+        """
+        if increment is None:
+            increment = self.current_increment - 1
+        return self.forecast_demand_matrix[:, increment]
+
+    def forecast_excess(self, increment=None):
+        """ 
+        Vectorized Household.forecast_excess_no_storage_simple(). 
 
-    
+        INPUT: 
+            increment (int): 0 based increment, defaults to the current one
+        RETURN: 
+            forecast_excess (np arr): (houses,) forecasted excess in kWh
+        """
+        if increment is None:
+            increment = self.current_increment - 1
+        return self.forecast_excess_matrix[:, increment]
 
-        
+    def fill_solar_prod_forecast_increment(self, increment=None):
+        """ 
+        Vectorized Household.fill_solar_prod_forecast_increment(), fills the 
+        forecasted production of every prosumer for a 0 based increment, or for 
+        a slice of increments. 
+        """
+        if increment is None:
+            increment = self.current_increment - 1
+        self.solar_prod_forecast_increment[:, increment] = self._forecast_production_totals[:, increment]
+
+    def step_increment(self, increments=1):
+
+        self.current_increment += increments
+        self.current_minute += self.increment * increments
+
+    def sync_households(self):
+        """ 
+        Copies the population's time step back onto the Household objects. 
+        """
+        for household in self.households:
+            household.current_increment = self.current_increment
+            household.current_minute = self.current_minute
 
+    def __len__(self):
+        return self.number_houses
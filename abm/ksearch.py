@@ -0,0 +1,178 @@
+import functools
+import math
+
+import numpy as np
+from scipy import stats
+
+from abm.sweep import make_pool, metric_field, prepare_configs, run_task
+
+
+# 1 / golden ratio
+INV_PHI = (math.sqrt(5) - 1) / 2
+
+
+def round_k(k, digits=3):
+    """
+    Rounds a liquidity k to a few significant digits, so nearby search points
+    map to the same configuration and its cached runs.
+    """
+    k = float(f"{k:.{digits}g}")
+    return int(k) if k.is_integer() else k
+
+
+class LiquidityObjective:
+    """
+    Mean of an aggregate metric over the runs of an amm configuration, as a
+    function of amm_liquidity_k. Every k is run with the same seed, so run n
+    of every k sees the same forecast noise and bid orders (common random
+    numbers) and two ks are compared run by run. The runs of a k are kept and
+    only extended when more are needed, runs found in the cache are not
+    simulated again.
+    """
+    def __init__(self, config, objective="total_production_for_market", maximize=True, seed=0, pool=None,
+                 retries=1, cache=None, on_result=None):
+
+        self.config = dict(config, exchange_type="amm")
+        self.config.setdefault("seed", seed)
+        self.field = metric_field(objective)
+        self.sign = 1.0 if maximize else -1.0
+        self.pool = pool
+        self.on_result = on_result
+        self.runner = functools.partial(run_task, retries=retries, quiet=True, cache=cache)
+
+        self.values = {}
+        self.simulated = 0
+
+    def runs(self, k, n_runs):
+        """
+        Makes sure k has at least n_runs runs and returns the signed objective
+        values of runs 1..n_runs, nan where the metric is undefined.
+        """
+        values = self.values.setdefault(k, [])
+        config_dict = dict(self.config, amm_liquidity_k=k)
+        tasks = [(0, run_number, config_dict) for run_number in range(len(values) + 1, n_runs + 1)]
+        results = map(self.runner, tasks) if self.pool is None else self.pool.imap(self.runner, tasks)
+        for result in results:
+            _, run_number, record, error, attempts = result
+            if self.on_result is not None:
+                self.on_result(result)
+            if record is None:
+                raise RuntimeError(f"run {run_number} of amm_liquidity_k={k} failed after {attempts} attempts\n{error}")
+            if attempts > 0:
+                self.simulated += 1
+            values.append(self.sign * float(getattr(record, self.field)))
+        return np.array(values[:n_runs])
+
+    def mean(self, k):
+        """
+        Signed mean objective over the runs of k so far.
+        """
+        values = np.array(self.values.get(k, []))
+        values = values[np.isfinite(values)]
+        return values.mean() if len(values) else -np.inf
+
+    def compare(self, k_a, k_b, runs, max_runs, confidence=0.95):
+        """
+        Returns True if k_a is at least as good as k_b, ties go to k_a. Both
+        are run runs times and, while the paired difference is not significant
+        at confidence, extended by runs more until max_runs.
+        """
+        n_runs = runs
+        while True:
+            difference = self.runs(k_a, n_runs) - self.runs(k_b, n_runs)
+            difference = difference[np.isfinite(difference)]
+            if len(difference) < 2:
+                mean, half_width = (difference.mean() if len(difference) else 0.0), np.inf
+            else:
+                t_value = stats.t.ppf(0.5 + confidence / 2, len(difference) - 1)
+                mean = difference.mean()
+                half_width = t_value * difference.std(ddof=1) / np.sqrt(len(difference))
+            #identical runs cannot become significant, they are a tie
+            if abs(mean) > half_width or half_width == 0 or n_runs >= max_runs:
+                return mean >= 0
+            n_runs = min(n_runs + runs, max_runs)
+
+
+def search_liquidity(config, objective="total_production_for_market", maximize=True, k_bounds=(10, 1000),
+                     k_tolerance=0.05, runs=4, max_runs=16, k_digits=3, max_steps=30, confidence=0.95, seed=0,
+                     workers=None, retries=1, cache=None, on_result=None):
+    """
+    Searches the amm_liquidity_k that optimizes an aggregate metric of an amm
+    configuration, by golden-section search over log k. Each step compares the
+    two inner points of the bracket on common random numbers and only runs
+    them more often while their difference is within the noise, so the search
+    needs a fraction of the runs of a dense grid. The objective is assumed to
+    be unimodal in log k over k_bounds.
+
+    INPUT:
+        config (dict): configuration with prosumer_count and perfect_forecasting,
+                       the household params are added if missing
+        objective (str): AggregateRecord field or csv column to optimize
+        maximize (bool): maximize the objective, minimize it if False
+        k_bounds (tuple): (lowest, highest) k searched
+        k_tolerance (float): the search stops once the bracket's highest k is
+                             within this fraction of its lowest
+        runs (int): runs per k and comparison step
+        max_runs (int): most runs of a k in a comparison
+        k_digits (int): significant digits of the k tried, see round_k()
+        max_steps (int): most golden-section steps
+        confidence (float): confidence level a difference has to be significant at
+        seed (int): seed of the runs, if config has none
+        workers (int): worker processes, 1 runs everything in this process
+        retries (int): how many times a failing run is retried
+        cache (RunCache): results cache, runs found in it are not simulated again
+        on_result (callable): called with the result tuple of every run
+
+    RETURN:
+        result (dict): best k, its mean objective, the mean objective and
+                       number of runs of every k tried and the runs simulated
+    """
+    if not 0 < k_bounds[0] < k_bounds[1]:
+        raise ValueError(f"k_bounds must be 0 < lowest < highest, got {k_bounds}")
+    if "household_params" not in config:
+        config = prepare_configs([config])[0]
+
+    pool = make_pool(workers)
+    try:
+        evaluate = LiquidityObjective(config, objective, maximize, seed, pool, retries, cache, on_result)
+        low, high = math.log(k_bounds[0]), math.log(k_bounds[1])
+        inner_low = high - INV_PHI * (high - low)
+        inner_high = low + INV_PHI * (high - low)
+
+        for _ in range(max_steps):
+            if high - low < math.log1p(k_tolerance):
+                break
+            k_low, k_high = round_k(math.exp(inner_low), k_digits), round_k(math.exp(inner_high), k_digits)
+            if k_low == k_high:
+                break
+            if evaluate.compare(k_low, k_high, runs, max_runs, confidence):
+                high, inner_high = inner_high, inner_low
+                inner_low = high - INV_PHI * (high - low)
+            else:
+                low, inner_low = inner_low, inner_high
+                inner_high = low + INV_PHI * (high - low)
+
+        #a bracket within tolerance from the start, or one round_k() collapses,
+        #is never stepped, its endpoints are compared instead
+        if not evaluate.values:
+            k_low, k_high = round_k(k_bounds[0], k_digits), round_k(k_bounds[1], k_digits)
+            if k_low == k_high:
+                evaluate.runs(k_low, runs)
+            else:
+                evaluate.compare(k_low, k_high, runs, max_runs, confidence)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            cache.evict()
+
+    #on a plateau the smallest k, the least liquidity, is the best
+    best = max(sorted(evaluate.values), key=evaluate.mean)
+    return {
+        "k": best,
+        "objective": evaluate.sign * evaluate.mean(best),
+        "evaluations": {k: (evaluate.sign * evaluate.mean(k), len(values))
+                        for k, values in sorted(evaluate.values.items())},
+        "simulated_runs": evaluate.simulated,
+    }
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class TradeLedger:
+    """
+    Columnar store for the per-household, per-increment accounting of a run.
+    All values live in one contiguous float array of shape
+    (houses, increments, fields). Fields are accessed by name and every
+    accessor returns a view, so writes go straight into the ledger.
+
+    Fields:
+        sold / sold_revenue: energy sold into the market and the revenue
+                             received for it (formerly seller_history[i][j][0/1])
+        bought / bought_expenditure: energy bought from the market and the amount
+                             paid for it (formerly buyer_history[i][j][0/1])
+        overproduction, shortfall, overbought, underbought, daytime_demand,
+        excess_solar: filled by Market.tally_op_sf_hh() at the end of a run
+    """
+
+    FIELDS = ("sold", "sold_revenue", "bought", "bought_expenditure",
+              "overproduction", "shortfall", "overbought", "underbought",
+              "daytime_demand", "excess_solar")
+
+    def __init__(self, number_houses, number_increments):
+
+        self.number_houses = number_houses
+        self.number_increments = number_increments
+        self.field_index = {name: i for i, name in enumerate(self.FIELDS)}
+        self.data = np.zeros((number_houses, number_increments, len(self.FIELDS)))
+
+    def __getitem__(self, name):
+        """
+        Returns a (houses, increments) view of the field name.
+        """
+        return self.data[:, :, self.field_index[name]]
+
+    def __setitem__(self, name, values):
+        """
+        Overwrites the field name with values, broadcast to (houses, increments).
+        """
+        self.data[:, :, self.field_index[name]] = values
+
+    def get_increment(self, name, increment):
+        """
+        Returns a (houses,) view of the field name for a 0 based increment.
+        """
+        return self.data[:, increment, self.field_index[name]]
+
+    def add(self, name, increment, house, value):
+        """
+        Adds value to the field name of a single house at a 0 based increment.
+        """
+        self.data[house, increment, self.field_index[name]] += value
+
+    def add_increment(self, name, increment, values):
+        """
+        Bulk update, adds a (houses,) array of values to the field name at a
+        0 based increment.
+        """
+        self.data[:, increment, self.field_index[name]] += values
+
+    def reset(self):
+        """
+        Zeros every field for a fresh run.
+        """
+        self.data[...] = 0.0
+
+    def totals(self):
+        """
+        Returns a dict with the sum of every field over all houses and increments.
+        """
+        sums = self.data.sum(axis=(0, 1))
+        return {name: float(sums[i]) for i, name in enumerate(self.FIELDS)}
+
+    def __str__(self):
+        return (f"TradeLedger(houses: {self.number_houses}, "
+                f"increments: {self.number_increments}, fields: {', '.join(self.FIELDS)})")
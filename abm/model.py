@@ -1,18 +1,41 @@
-from abm.household import Household
-from abm.amm import AMM 
+from abm.household import Household, HouseholdPopulation, SharedProfile
+from abm.amm import AMM, AMM_IMPLEMENTATIONS, ScenarioPools, BUY, SELL, liquidity_reserves
+from abm.solar import solar_geometry, collector_radiation
+from abm.ledger import TradeLedger
+from abm.clearing import clearing_price, clearing_prices
+from abm.equilibrium import EquilibriumCache, DEFAULT_EQUILIBRIUM_DIR
+from abm.aggregate import reduce_aggregates
+from abm.sinks import default_sink
+from abm.recorder import BOUGHT, SOLD, BUY_REJECTED, SELL_REJECTED
+from abm.datastore import load_data_array
 import pandas as pd
 import os
 import numpy as np 
-import math 
-import csv 
-from scipy.interpolate import interp1d
-from scipy.optimize import fsolve
 import random
 
 
+# Version tag of the model's results. Bump it whenever a change alters the 
+# output of a run, so results cached under the old version are not reused.
+MODEL_VERSION = 4
+
+
+# Configuration keys a scenario run can vary, see Market.run_scenarios()
+SCENARIO_KEYS = ("amm_liquidity_k", "amm_transaction_fee")
+
+
+def simulation_name(config):
+    """ 
+    Name under which the runs of a configuration are logged. A non zero 
+    amm_transaction_fee is appended. 
+    """
+    name = f"prosumer{config['prosumer_count']}_{config['exchange_type']}_k{str(config['amm_liquidity_k'])}"
+    if config.get("amm_transaction_fee"):
+        name += f"_fee{config['amm_transaction_fee']}"
+    return name
+
 
 class Market:
-    def __init__(self, config, run_number = 1):
+    def __init__(self, config, run_number = 1, write_output = True, sink = None, recorder = None, orderflow = None):
         # Global Variables for accurately calculating solar production from fixed tilt arrays
         self.latitude = 20.77 
         self.longitude = 156.92
@@ -20,8 +43,22 @@ class Market:
 
 
         self.sim_config = config # simulation configuration for one run. 
-        self.simulation_name = f"prosumer{config['prosumer_count']}_{config['exchange_type']}_k{str(config['amm_liquidity_k'])}"
+        self.simulation_name = simulation_name(config)
         self.run_number = run_number
+        self.write_output = write_output # emit the aggregate results, sweeps write them in the parent process instead
+        self.sink = sink # results sink receiving the record of the run, the shared csv sink if None
+        self.recorder = recorder # optional TimestepRecorder streaming the per increment state of the run
+        self.increment_trace = None # trace of the current increment, only kept while recording
+        self.orderflow = orderflow # optional OrderFlowWriter capturing the amm order flow of the run
+        self.batch_clearing = self.sim_config.get("batch_clearing", False) # clear every increment in one batched pass
+        self.verbose = self.sim_config.get("verbose", False) # print every hour's amm pool reserves
+        self.transaction_fee = self.sim_config.get("amm_transaction_fee", 0) # fee of the hourly amm pools
+        self.amm_class = AMM_IMPLEMENTATIONS[self.sim_config.get("amm_implementation", "lean")] # class of the hourly amm pools
+        self.amm_pool = None # pool reused by every hour of the run, see setup_amm()
+        self.order_books = None # amm order books and equilibrium prices of the run, see amm_order_books()
+        self.equilibrium_series = None # (increments,) equilibrium price of every increment, nan without a market
+        self.noise_rng = None # random streams of the run, set by initialize_households()
+        self.bid_rng = None
         #households 
         self.households  = [] #probably going to hold everything 
 
@@ -66,14 +103,8 @@ class Market:
         self.cumulative_elec_savings = [0.0] * self.simulation_steps
         self.total_adopters = [0] * self.simulation_steps
         self.cumulative_peak_capacity = [0.0] * self.simulation_steps
-        self.seller_history = [[[0.0, 0.0, 0.0] for _ in range(self.number_increments)] for _ in range(self.number_houses)]
-        self.buyer_history = [[[0.0, 0.0] for _ in range(self.number_increments)] for _ in range(self.number_houses)]
-        self.overproduction = [[0.0] * self.number_increments for _ in range(self.number_houses)]
-        self.shortfall = [[0.0] * self.number_increments for _ in range(self.number_houses)]
-        self.overbought = [[0.0] * self.number_increments for _ in range(self.number_houses)]
-        self.underbought = [[0.0] * self.number_increments for _ in range(self.number_houses)]
-        self.daytime_demand = [[0.0] * self.number_increments for _ in range(self.number_houses)]
-        self.excess_solar = [[0.0] * self.number_increments for _ in range(self.number_houses)]
+        # Per household, per increment accounting (energy sold/bought, shortfall, etc.)
+        self.ledger = TradeLedger(self.number_houses, self.number_increments)
         self.interval_average_seller_price = [0.0] * self.number_increments
         self.running_average_seller_price = [0.0] * self.number_increments
 
@@ -108,16 +139,18 @@ class Market:
         print(f"Interval Average Seller Price: {self.interval_average_seller_price}")
         print(f"Running Average Seller Price: {self.running_average_seller_price}")
 
-        print(f"seller_history = {self.seller_history}")
-        print(f"buyer_history = {self.buyer_history}")
-        print(f"shortfall = {self.shortfall}")
-        print(f"overproduction = {self.overproduction}")
+        print(f"ledger = {self.ledger}")
+        print(f"sold = {self.ledger['sold']}")
+        print(f"bought = {self.ledger['bought']}")
+        print(f"shortfall = {self.ledger['shortfall']}")
+        print(f"overproduction = {self.ledger['overproduction']}")
 
 
     def initialize_households(self):
         """ 
         Initialize the parameters of the households. Note, the model stores each
-        household within a list class variable called self.households.
+        household within a list class variable called self.households, and a 
+        HouseholdPopulation of the same households in self.population.
 
         INPUTS: 
             None
@@ -128,24 +161,30 @@ class Market:
 
         # Initialize households and demand ledgers
         household_configs = self.sim_config["household_params"]
-        total_houses = len(household_configs) #total households
         self.households = [] #list to store household objects
 
-        #Household Energy Demand initialization
-        demandLedger = np.zeros((total_houses, self.hours_in_month))
-        demandLedgerMinutely = np.zeros((total_houses, self.hours_in_month * 60))
-
-        hourly_cons_df = self.load_data_file("hourly_consumption")
-        #Converts DataFrame column to Series
-        hourly_demand_series = hourly_cons_df['hourly_consumption'].squeeze()  
+        #memory-mapped binary copies of the csv files, see abm/datastore.py
+        hourly_demand_series = self.load_data_array("hourly_consumption")
 
         #Household/Prosumer Energy solar irradiance array
-        minutely_monthly_prod_df = self.load_data_file("production_monthly_minutely")
-        minutely_monthly_prod_series = minutely_monthly_prod_df.squeeze() 
+        minutely_monthly_prod_series = self.load_data_array("production_monthly_minutely")
 
         #solar energy production array 
         self.solar_energy_production_arr = self.adjustIrradiance(minutely_monthly_prod_series)
 
+        #NOTE: 
+        #Every house uses the same two profiles, scaled by its floor area 
+        #(demand) or roof area (production). Houses hold lazy ScaledProfile 
+        #views of the shared profiles, so no per house minutely arrays are made. 
+        #Hourly demand is held for each of the hour's minutes (not divided by 60), 
+        #an artifact of the original java code, the increment totals divide by 60. 
+        self.demand_profile = SharedProfile(hourly_demand_series / self.benchmark_area, self.increment, hold=60)
+
+        #There are a lot of assumptions
+        #for more details on this equation look at the jupyter notebook
+        #production per square foot of roof, before the roof_area * 0.10 share covered by panels
+        self.production_profile = SharedProfile(self.solar_energy_production_arr * 0.092903 * 0.10 * 0.253 * 0.77, self.increment)
+
         #print(solar_energy_production_arr[0:1000])
         # Combined initialization loop
         for i, hh_config in enumerate(household_configs):
@@ -159,32 +198,23 @@ class Market:
             # Create household object
             household_obj = Household(index, has_pv, floor_area, wta, wtp, perfect_forecasting,run)
             
-            # Calculate hourly demand scaled by floor area
-            demandLedger[i] = (hourly_demand_series / self.benchmark_area) * floor_area
-
-            #NOTE: 
-            #This for loop sets the value of hourly demand 
-            #to each minute, as opposed to dividing by 60 
-            #this is an artifact of the original java code
-            #later in forecast energy demand, the individual values are divided by 60
-            #which is also inefficient, but will be updated in a refactoring.
-            for j in range(self.hours_in_month):
-                start_minute = j * 60
-                end_minute = start_minute + 60
-                demandLedgerMinutely[i, start_minute:end_minute] = demandLedger[i][j] 
-            
-            #we set their minutely use
-            household_obj.set_electricity_use(demandLedgerMinutely[i]) 
-
-            #we set their minutely production 
-            #There are a lot of assumptions
-            #for more details on this equation look at the jupyter notebook
-            house_estimated_minutely_production = self.solar_energy_production_arr * 0.092903 * (household_obj.roof_area * 0.10) * 0.253 * 0.77
-            household_obj.set_solar_production(house_estimated_minutely_production)
-            household_obj.set_forecasted_solar_production() #set the solar forecast 
+            #we set their minutely use, hourly demand scaled by floor area
+            household_obj.set_electricity_use(self.demand_profile.scaled(floor_area)) 
+
+            #we set their minutely production, scaled by roof area
+            household_obj.set_solar_production(self.production_profile.scaled(household_obj.roof_area))
             
             #Lastly, add households to a household list
             self.households.append(household_obj) 
+
+        #struct-of-arrays view of all households used by the exchanges and tallies
+        self.population = HouseholdPopulation(self.households)
+
+        #set the solar forecast of every house, drawn in bulk from the run's noise stream
+        self.noise_rng, self.bid_rng = self.run_streams()
+        self.population.set_forecasted_production(self.noise_rng,
+                                                  resolution=self.sim_config.get("forecast_noise_resolution", "minutely"),
+                                                  dtype=np.dtype(self.sim_config.get("forecast_noise_dtype", "float64")))
         
    
     def run_simulation(self): 
@@ -196,7 +226,7 @@ class Market:
         INPUT: 
         
         RETURN: 
-            NONE
+            record (AggregateRecord): aggregate results of the run
         
         """
         print(f"-"*50, "RUN SIMULATION", f"-"*50)
@@ -204,31 +234,124 @@ class Market:
 
         
         self.initialize_households()
+        self.load_order_books()
         print(f"-"*30, "Initialization Complete", f"-"*30)
 
         exchange_type = self.sim_config["exchange_type"]
-        for timestep in range(self.number_increments): 
-            #print(f"-"*20, f"timestep : {timestep}", f"-"*20)
-            
+        recorder = self.recorder
+        market_possible = self.population.market_possible
+        if self.batch_clearing:
+            #the hourly markets are independent, clear all of them at once
+            traces = None
+            if recorder is not None:
+                traces = [recorder.new_trace() for _ in range(self.number_increments)]
+
             if exchange_type == "bilateral":
-                self.exchangeNoStorage()
+                self.exchange_no_storage_batch(traces)
             elif exchange_type == "amm":
-                self.amm_exchange()
+                self.amm_exchange_batch(traces)
 
+            if recorder is not None:
+                for timestep, trace in enumerate(traces):
+                    recorder.record(timestep, trace, self.ledger, self.population)
 
-    
-            self.current_minute += self.increment #we update 
-            self.current_increment +=1 
+            self.current_minute += self.increment * self.number_increments
+            self.current_increment += self.number_increments
+            self.population.step_increment(self.number_increments)
 
-            for i in range(self.number_houses):
-                self.households[i].step_increment()
+        else:
+            for timestep in range(self.number_increments): 
+                #print(f"-"*20, f"timestep : {timestep}", f"-"*20)
+                if recorder is not None:
+                    self.increment_trace = recorder.new_trace()
+                
+                if not market_possible[timestep]:
+                    #no buyer or no seller, the exchange would not trade
+                    self.skip_exchange(timestep, exchange_type, self.increment_trace)
+                elif exchange_type == "bilateral":
+                    self.exchangeNoStorage()
+                elif exchange_type == "amm":
+                    self.amm_exchange()
+
+                if recorder is not None:
+                    recorder.record(timestep, self.increment_trace, self.ledger, self.population)
+
+        
+                self.current_minute += self.increment #we update 
+                self.current_increment +=1 
 
+                self.population.step_increment()
+
+        self.population.sync_households()
+        if recorder is not None:
+            recorder.close()
+        if self.orderflow is not None:
+            self.orderflow.close()
         print(f"Finished All timesteps")
         print(f"current_minute = {self.current_minute}")
         print(f"current_increment = {self.current_increment}")
 
         self.tally_op_sf_hh()
-        self.tally_op_sf_totals()
+        return self.tally_op_sf_totals()
+
+    def run_scenarios(self, scenarios):
+        """ 
+        Runs one amm simulation for several pool scenarios at once. The 
+        households, forecasts, equilibrium prices and bid orders are computed 
+        once and shared, see amm_exchange_scenarios(), and every scenario gets 
+        its own ledger and aggregate record. A sweep over S values of 
+        amm_liquidity_k costs about one simulation instead of S. 
+
+        INPUT: 
+            scenarios (list of dict): overrides of amm_liquidity_k and/or 
+                                      amm_transaction_fee, one per scenario
+        RETURN: 
+            records (list of AggregateRecord): one per scenario, in order
+        """
+        if self.sim_config["exchange_type"] != "amm":
+            raise ValueError("scenario runs need exchange_type 'amm'")
+        for scenario in scenarios:
+            unknown = set(scenario) - set(SCENARIO_KEYS)
+            if unknown:
+                raise ValueError(f"scenarios can only change {SCENARIO_KEYS}, got {sorted(unknown)}")
+
+        print(f"-"*50, "RUN SCENARIOS", f"-"*50)
+        print(f"-"*30, "Initializing", f"-"*30)
+        self.initialize_households()
+        self.load_order_books()
+        print(f"-"*30, "Initialization Complete", f"-"*30)
+
+        base_config = self.sim_config
+        scenario_configs = [dict(base_config, **scenario) for scenario in scenarios]
+        liquidity_k = np.array([config["amm_liquidity_k"] for config in scenario_configs], dtype=float)
+        transaction_fee = np.array([config.get("amm_transaction_fee", 0) for config in scenario_configs], dtype=float)
+        trades = self.amm_exchange_scenarios(liquidity_k, transaction_fee)
+
+        self.current_minute += self.increment * self.number_increments
+        self.current_increment += self.number_increments
+        self.population.step_increment(self.number_increments)
+        self.population.sync_households()
+        if self.orderflow is not None:
+            self.orderflow.close()
+        print(f"Finished All timesteps")
+
+        #tally every scenario on its own ledger
+        records = []
+        self.scenario_ledgers = []
+        for s, config in enumerate(scenario_configs):
+            self.sim_config = config
+            self.simulation_name = simulation_name(config)
+            self.ledger = TradeLedger(self.number_houses, self.number_increments)
+            for name, values in trades.items():
+                self.ledger[name] = values[s]
+            self.scenario_ledgers.append(self.ledger)
+
+            self.tally_op_sf_hh()
+            records.append(self.tally_op_sf_totals())
+
+        self.sim_config = base_config
+        self.simulation_name = simulation_name(base_config)
+        return records
 
     def amm_exchange(self): 
         """ 
@@ -238,22 +361,16 @@ class Market:
 
         #print(f"-"*15, "STARTING AMM EXCHANGE", f"-"*15)
 
-        excess = np.zeros(self.number_houses)
-        demand = np.zeros(self.number_houses)
-        wtp_arr = np.zeros(self.number_houses)
-        wta_arr = np.zeros(self.number_houses)
+        population = self.population
+        increment = self.current_increment - 1
+        trace = self.increment_trace
 
-        #print(f"Exchange No Storage: current_round = {current_round}")
-        for i in range(self.number_houses):
-            #print(f"-"*5, f"Household: {i}",f"-"*5)
-
-            household = self.households[i]
-            
-            demand[i] = max(household.forecast_demand_no_storage_simple() - self.buyer_history[i][self.current_increment - 1][0], 0)
-            excess[i] = max(household.forecast_excess_no_storage_simple() - self.seller_history[i][self.current_increment - 1][0], 0)
-            
-            wtp_arr[i] = household.get_wtp()
-            wta_arr[i] = household.get_wta()
+        forecast_demand = population.forecast_demand(increment)
+        forecast_excess = population.forecast_excess(increment)
+        demand = np.maximum(forecast_demand - self.ledger.get_increment("bought", increment), 0)
+        excess = np.maximum(forecast_excess - self.ledger.get_increment("sold", increment), 0)
+        wtp_arr = population.wtp
+        wta_arr = population.wta
         
         # print(f"demand : {demand}")
         # print(f"excess : {excess}")
@@ -270,122 +387,433 @@ class Market:
             pass
 
         else:
-            buyer_index = np.where(demand > 0)[0]
-            seller_index = np.where(excess > 0)[0]
-
-            # Order buyers by willingness to pay (WTP)
-            buyers_ordered = sorted(buyer_index, key=lambda x: self.households[x].get_wtp(), reverse=True)
-            # Order sellers by willingness to accept (WTA)
-            sellers_ordered = sorted(seller_index, key=lambda x: self.households[x].get_wta())
-            
-            # print(f"buyers_index= {buyer_index}")
-            # print(f"seller_index= {seller_index}")
-            # print(f"buyers_ordered= {buyers_ordered}")
-            # print(f"sellers_ordered= {sellers_ordered}")
-
-            buyer_demand = demand[buyers_ordered]
-            excess_supply = excess[sellers_ordered]
-            buyer_wtp = wtp_arr[buyers_ordered]
-            seller_wta = wta_arr[sellers_ordered]
-
-            # print(f"buyer_demand= {buyer_demand}")
-            # print(f"excess_supply= {excess_supply}")
-            # print(f"buyer_wtp= {buyer_wtp}")
-            # print(f"seller_wta= {seller_wta}")
-            # Calculate cumulative demand and supply
-            cumulative_demand = np.cumsum(buyer_demand)
-            cumulative_supply = np.cumsum(excess_supply)
-
-            # Interpolation functions for cumulative demand and supply
-            cumulative_demand_interp = interp1d(buyer_wtp, cumulative_demand, kind='linear', fill_value="extrapolate")
-            cumulative_supply_interp = interp1d(seller_wta, cumulative_supply, kind='linear', fill_value="extrapolate")
-
-            # Define the equilibrium function
-            def equilibrium_function(price):
-                return cumulative_demand_interp(price) - cumulative_supply_interp(price)
+            if self.equilibrium_series is not None:
+                #every hour's price was computed (or loaded) before the first 
+                #exchange, see load_order_books()
+                equilibrium_price = self.equilibrium_series[increment]
+            else:
+                buyer_index = np.where(demand > 0)[0]
+                seller_index = np.where(excess > 0)[0]
+
+                # Order buyers by willingness to pay (WTP)
+                buyers_ordered = buyer_index[np.argsort(-wtp_arr[buyer_index], kind="stable")]
+                # Order sellers by willingness to accept (WTA)
+                sellers_ordered = seller_index[np.argsort(wta_arr[seller_index], kind="stable")]
             
-            # Solve for the equilibrium price
-            initial_guess = np.mean(buyer_wtp)  # Initial guess can be the mean of WTP values
-            equilibrium_price = fsolve(equilibrium_function, initial_guess)[0]
+                # print(f"buyers_index= {buyer_index}")
+                # print(f"seller_index= {seller_index}")
+                # print(f"buyers_ordered= {buyers_ordered}")
+                # print(f"sellers_ordered= {sellers_ordered}")
+
+                buyer_demand = demand[buyers_ordered]
+                excess_supply = excess[sellers_ordered]
+                buyer_wtp = wtp_arr[buyers_ordered]
+                seller_wta = wta_arr[sellers_ordered]
+
+                # print(f"buyer_demand= {buyer_demand}")
+                # print(f"excess_supply= {excess_supply}")
+                # print(f"buyer_wtp= {buyer_wtp}")
+                # print(f"seller_wta= {seller_wta}")
+                # Calculate cumulative demand and supply
+                cumulative_demand = np.cumsum(buyer_demand)
+                cumulative_supply = np.cumsum(excess_supply)
+
+                # Solve for the equilibrium price, the exact crossing of the linearly
+                # interpolated (and extrapolated) cumulative demand and supply curves
+                initial_guess = np.mean(buyer_wtp)  # Preferred root, and the fallback when the curves do not cross
+                equilibrium_price = clearing_price(buyer_wtp, cumulative_demand, seller_wta, cumulative_supply, initial_guess)
+                if np.isnan(equilibrium_price):
+                    equilibrium_price = initial_guess
 
             #amount of tokens to use to initialize the AMM 
             x_token_amt, y_token_amt = self.determine_amm_liquidity(equilibrium_price)
             
-            print(x_token_amt, y_token_amt)
+            if self.verbose:
+                print(x_token_amt, y_token_amt)
             #setup the amm
-            amm = AMM(transaction_fee= 0, debug= False)
-            amm.setup_pool(quantity_x=x_token_amt, quantity_y= y_token_amt)
+            amm = self.setup_amm(x_token_amt, y_token_amt)
+            if trace is not None:
+                trace["equilibrium_price"] = equilibrium_price
+                trace["amm_initial_x"] = x_token_amt
+                trace["amm_initial_y"] = y_token_amt
 
+            self.amm_swaps(increment, amm, forecast_demand, forecast_excess, trace, equilibrium_price)
 
-            household_index_list = list(range(self.number_houses))
-            
-            #print(f"household_index_list = {household_index_list}")
-            random.shuffle(household_index_list) #shuffle the list in place
-            #print(f"household_index_list = {household_index_list}")
-
-            #buyers and sellers make bids in random order
-            for i in household_index_list:
-                household = self.households[i]
-                demand = household.forecast_demand_no_storage_simple()
-                excess = household.forecast_excess_no_storage_simple()
-                wtp = household.get_wtp()
-                wta = household.get_wta()
-                
-                if demand > 0 : 
-                    token = "y" #energy token within our simulation
-                    token_quantity_requested = demand
-                    max_price = demand*wtp
-
-                    #print(f"token = {token}")
-                    #print(f"token_quantity_requested = {token_quantity_requested}")
-                    #print(f"max_price = {max_price}")
-
-                    trade_dict = amm.buy_tokens_max_price(token, 
-                                            token_quantity_requested,
-                                            max_price)
-                    if trade_dict["quantity_needed"] == "NoTrade":
-                        continue
-
-                    else: 
-                        #print(f"trade_dict = {trade_dict}")
-                        amount_spend = trade_dict["quantity_needed"] #amount of token x spent
-                        self.buyer_history[i][self.current_increment - 1][0] += demand
-                        self.buyer_history[i][self.current_increment - 1][1] += amount_spend
-                        #print(f"buyer_history: {self.buyer_history[i]}")
-
-                elif excess > 0:
-                    token = "x"
-                    quantity_for_sale = excess
-                    min_price = excess*wta
-
-                    #print(f"token = {token}")
-                    #print(f"quantity_for_sale = {quantity_for_sale}")
-                    #print(f"min_price = {min_price}")
-
-                    trade_dict = amm.sell_tokens_min_price(token, 
-                                              quantity_for_sale,
-                                              min_price)
-
-                    if trade_dict["quantity_returned"] == "NoTrade":
-                        continue
-
-                    else:
-                        #print(f"trade_dict = {trade_dict}")
-                        amount_recieved= trade_dict["quantity_returned"] #amount of token x spent
-                        self.seller_history[i][self.current_increment - 1][0] += quantity_for_sale
-                        self.seller_history[i][self.current_increment - 1][1] += amount_recieved
-                        #print(f"seller_history: {self.seller_history[i]}")
-
-                else: #if households have no demand or supply 
-                    pass 
-        
         #print(f"-"*15, "ENDING AMM EXCHANGE", f"-"*15)
             
-        for i in range(self.number_houses):
-            self.households[i].fill_solar_prod_forecast_increment()
+        population.fill_solar_prod_forecast_increment(increment)
     
 
-    def determine_amm_liquidity(self, equilibrium_price):
+    def amm_orders(self, household_index_list, forecast_demand, forecast_excess):
+        """ 
+        The orders households send to an hour's pool, in bid order. Houses with 
+        forecasted demand buy it for at most demand*wtp, houses with forecasted 
+        excess sell it for at least excess*wta, all other houses send nothing. 
+
+        INPUT: 
+            household_index_list (list of int): bid order of the houses
+            forecast_demand, forecast_excess (np arr): (houses,) kWh
+        RETURN: 
+            houses (np arr of int), sides (np arr of int8, BUY or SELL), 
+            quantities (np arr), limits (np arr): one entry per order
+        """
+        order = np.asarray(household_index_list, dtype=int)
+        demand = forecast_demand[order]
+        excess = forecast_excess[order]
+        buying = demand > 0
+        active = buying | (excess > 0)
+
+        houses = order[active]
+        sides = np.where(buying, BUY, SELL).astype(np.int8)[active]
+        quantities = np.where(buying, demand, excess)[active]
+        limits = np.where(buying, demand*self.population.wtp[order], excess*self.population.wta[order])[active]
+        return houses, sides, quantities, limits
+
+    def amm_swaps(self, increment, amm, forecast_demand, forecast_excess, trace=None, equilibrium_price=np.nan):
+        """ 
+        Households make their bids to a set up AMM pool in random order, buyers 
+        buy their forecasted demand if the price is within demand*wtp and sellers 
+        sell their forecasted excess if they receive at least excess*wta. The 
+        whole hour's bids go to the pool as one AMM.execute_batch() call. 
+
+        INPUT: 
+            increment (int): 0 based increment the swaps are booked to
+            amm (LeanAMM or AMM): pool of the increment, see setup_amm()
+            forecast_demand, forecast_excess (np arr): (houses,) kWh
+            trace (dict): optional increment trace of the TimestepRecorder
+            equilibrium_price (float): price the pool was set up at, captured 
+                                       with the order flow
+        """
+        household_index_list = self.bid_order()
+        #print(f"household_index_list = {household_index_list}")
+        houses, sides, quantities, limits = self.amm_orders(household_index_list, forecast_demand, forecast_excess)
+        if self.orderflow is not None:
+            self.orderflow.add_hour(increment, equilibrium_price, houses, sides, quantities, limits)
+
+        #buyers and sellers make bids in random order
+        fills, amounts, accepted, reserve_x, reserve_y = amm.execute_batch(sides, quantities, limits)
+
+        #every house sends at most one order per hour
+        buy = sides == BUY
+        bought = buy & accepted
+        sold = ~buy & accepted
+        self.ledger.get_increment("bought", increment)[houses[bought]] += fills[bought]
+        self.ledger.get_increment("bought_expenditure", increment)[houses[bought]] += amounts[bought]
+        self.ledger.get_increment("sold", increment)[houses[sold]] += fills[sold]
+        self.ledger.get_increment("sold_revenue", increment)[houses[sold]] += amounts[sold]
+
+        if trace is not None:
+            status = trace["trade_status"]
+            status[houses[bought]] = BOUGHT
+            status[houses[sold]] = SOLD
+            status[houses[buy & ~accepted]] = BUY_REJECTED
+            status[houses[~buy & ~accepted]] = SELL_REJECTED
+            trace["trades"] += int(np.count_nonzero(accepted))
+            trace["rejections"] += int(np.count_nonzero(~accepted))
+            trace["amm_reserve_x"] = reserve_x
+            trace["amm_reserve_y"] = reserve_y
+
+    def skip_exchange(self, increment, exchange_type, trace=None):
+        """ 
+        Books an increment without buyers or sellers, where the exchange would 
+        not trade. Only the forecast bookkeeping and the trace are updated. 
+
+        INPUT: 
+            increment (int): 0 based increment
+            exchange_type (str): "bilateral" or "amm"
+            trace (dict): optional increment trace of the TimestepRecorder
+        """
+        population = self.population
+        if trace is not None and exchange_type == "bilateral":
+            #the single round that finds nothing to trade, every order stays unfilled
+            demand = population.forecast_demand(increment)
+            excess = population.forecast_excess(increment)
+            trace["rounds"] = 1
+            trace["trade_status"][demand > 0] = BUY_REJECTED
+            trace["trade_status"][excess > 0] = SELL_REJECTED
+            trace["rejections"] = int(np.count_nonzero(demand > 0) + np.count_nonzero(excess > 0))
+
+        population.fill_solar_prod_forecast_increment(increment)
+
+    def amm_equilibrium_prices(self):
+        """ 
+        Equilibrium prices of every hour with buyers and sellers, before any 
+        swaps, from the run's order books (see amm_order_books()). 
+
+        RETURN: 
+            hours (np arr of int): 0 based increments with a market
+            equilibrium_price (np arr): (hours,) price of each of them
+        """
+        if self.order_books is None:
+            self.order_books = self.amm_order_books()
+        return self.order_books["hours"], self.order_books["equilibrium_price"]
+
+    def amm_order_books(self):
+        """ 
+        Order books of every hour with buyers and sellers, before any swaps. 
+        The order books of all hours are built with array operations and 
+        cleared at once, none of it depends on amm_liquidity_k. 
+
+        RETURN: 
+            order_books (dict): 
+                hours (np arr of int): 0 based increments with a market
+                equilibrium_price (np arr): (hours,) price of each of them
+        """
+        population = self.population
+        wtp_arr = population.wtp
+        wta_arr = population.wta
+        buyer_priority = population.buyer_priority
+        seller_priority = population.seller_priority
+
+        # (houses, increments), nothing is bought or sold before the swaps
+        forecast_demand = population.forecast_demand_matrix
+        forecast_excess = population.forecast_excess_matrix
+
+        # Order books of every hour: active buyers and sellers moved to the 
+        # front of the price priority order, padded with nan
+        demand_ordered = forecast_demand[buyer_priority]
+        excess_ordered = forecast_excess[seller_priority]
+        buyer_active = demand_ordered > 0
+        seller_active = excess_ordered > 0
+        market_hours = buyer_active.any(axis=0) & seller_active.any(axis=0)
+
+        buyer_front = np.argsort(~buyer_active, axis=0, kind="stable")
+        seller_front = np.argsort(~seller_active, axis=0, kind="stable")
+        buyer_kept = np.take_along_axis(buyer_active, buyer_front, axis=0)
+        seller_kept = np.take_along_axis(seller_active, seller_front, axis=0)
+
+        buyer_wtp = np.where(buyer_kept, wtp_arr[buyer_priority][buyer_front], np.nan)
+        seller_wta = np.where(seller_kept, wta_arr[seller_priority][seller_front], np.nan)
+        cumulative_demand = np.cumsum(np.take_along_axis(demand_ordered, buyer_front, axis=0), axis=0)
+        cumulative_supply = np.cumsum(np.take_along_axis(excess_ordered, seller_front, axis=0), axis=0)
+
+        hours = np.flatnonzero(market_hours)
+        initial_guess = np.nanmean(buyer_wtp[:, hours], axis=0)
+        equilibrium_price = clearing_prices(buyer_wtp[:, hours].T, cumulative_demand[:, hours].T,
+                                            seller_wta[:, hours].T, cumulative_supply[:, hours].T, initial_guess)
+        equilibrium_price = np.where(np.isnan(equilibrium_price), initial_guess, equilibrium_price)
+        return {"hours": hours, "equilibrium_price": equilibrium_price}
+
+    def load_order_books(self):
+        """ 
+        With "equilibrium_cache" in the config (a directory, or true for 
+        simulation_output/equilibrium_cache), reads the run's order books from 
+        the EquilibriumCache, or computes and stores them on a miss, and sets 
+        the equilibrium price series every amm exchange of the run uses. Runs 
+        that only differ in amm_liquidity_k share the artifact. 
+        """
+        cache_dir = self.sim_config.get("equilibrium_cache")
+        if not cache_dir or self.sim_config["exchange_type"] != "amm":
+            return
+        cache = EquilibriumCache(DEFAULT_EQUILIBRIUM_DIR if cache_dir is True else cache_dir)
+        key = cache.key(self.sim_config, MODEL_VERSION)
+
+        order_books = cache.get(key)
+        if order_books is None:
+            order_books = self.amm_order_books()
+            cache.put(key, order_books)
+        self.order_books = order_books
+
+        self.equilibrium_series = np.full(self.number_increments, np.nan)
+        self.equilibrium_series[order_books["hours"]] = order_books["equilibrium_price"]
+
+    def amm_exchange_batch(self, traces=None):
+        """ 
+        Batched amm_exchange() over every increment of the run. The order books, 
+        equilibrium prices and pool sizes of all hours are computed with array 
+        operations, only the swaps against each hour's pool run hour by hour, 
+        in the same order and with the same random bid order as amm_exchange(). 
+
+        INPUT: 
+            traces (list of dict): optional per increment traces of the TimestepRecorder
+        """
+        population = self.population
+        forecast_demand = population.forecast_demand_matrix
+        forecast_excess = population.forecast_excess_matrix
+        hours, equilibrium_price = self.amm_equilibrium_prices()
+
+        #amount of tokens to use to initialize every hour's AMM 
+        x_token_amt, y_token_amt = self.determine_amm_liquidity(equilibrium_price)
+
+        for increment, price, x_amt, y_amt in zip(hours, equilibrium_price, x_token_amt, y_token_amt):
+            if self.verbose:
+                print(x_amt, y_amt)
+            amm = self.setup_amm(x_amt, y_amt)
+
+            trace = None
+            if traces is not None:
+                trace = traces[increment]
+                trace["equilibrium_price"] = price
+                trace["amm_initial_x"] = x_amt
+                trace["amm_initial_y"] = y_amt
+
+            self.amm_swaps(increment, amm, forecast_demand[:, increment], forecast_excess[:, increment], trace, price)
+
+        population.fill_solar_prod_forecast_increment(slice(None))
+
+    def setup_amm(self, x_token_amt, y_token_amt):
+        """
+        Returns the pool of an hour set up with the given reserves. The lean 
+        pools (config amm_implementation "lean", the default, or "instrumented") 
+        are one instance per run reset every hour, the teaching AMM 
+        ("teaching") is created fresh every hour. 
+        """
+        if self.amm_class is AMM:
+            amm = AMM(transaction_fee= self.transaction_fee, debug= False)
+        else:
+            if self.amm_pool is None:
+                self.amm_pool = self.amm_class(self.transaction_fee)
+            amm = self.amm_pool
+        amm.setup_pool(quantity_x=x_token_amt, quantity_y= y_token_amt)
+        return amm
+
+    def amm_exchange_scenarios(self, liquidity_k, transaction_fee):
+        """ 
+        amm_exchange_batch() for S pool scenarios at once. Every hour's 
+        equilibrium price and bid order are the same in all scenarios, only 
+        the pools differ, so each hour's orders are applied to S pools held 
+        as arrays (see ScenarioPools). Scenario s trades exactly what a run 
+        with its amm_liquidity_k and amm_transaction_fee would. 
+
+        INPUT: 
+            liquidity_k, transaction_fee (np arr): (S,) pool parameters
+        RETURN: 
+            trades (dict): sold, sold_revenue, bought and bought_expenditure, 
+                           (S, houses, increments) each
+        """
+        population = self.population
+        forecast_demand = population.forecast_demand_matrix
+        forecast_excess = population.forecast_excess_matrix
+        hours, equilibrium_price = self.amm_equilibrium_prices()
+
+        shape = (len(liquidity_k), self.number_houses, self.number_increments)
+        trades = {name: np.zeros(shape) for name in ("sold", "sold_revenue", "bought", "bought_expenditure")}
+        sold, sold_revenue = trades["sold"], trades["sold_revenue"]
+        bought, bought_expenditure = trades["bought"], trades["bought_expenditure"]
+
+        # (hours, S) amounts of tokens every hour's pools start with
+        x_token_amt, y_token_amt = self.determine_amm_liquidity(equilibrium_price[:, None], liquidity_k[None, :])
+        pools = ScenarioPools(transaction_fee)
+
+        for increment, price, x_amt, y_amt in zip(hours, equilibrium_price, x_token_amt, y_token_amt):
+            pools.setup_pools(x_amt, y_amt)
+            orders = self.amm_orders(self.bid_order(), forecast_demand[:, increment], forecast_excess[:, increment])
+            if self.orderflow is not None:
+                self.orderflow.add_hour(increment, price, *orders)
+
+            #buyers and sellers make bids in random order, to every pool
+            for i, side, quantity, limit in zip(*orders):
+                if side == BUY:
+                    accepted, amount_spend = pools.buy_y_max_price(quantity, limit)
+                    bought[accepted, i, increment] += quantity
+                    bought_expenditure[accepted, i, increment] += amount_spend[accepted]
+                else:
+                    accepted, amount_recieved = pools.sell_x_min_price(quantity, limit)
+                    sold[accepted, i, increment] += quantity
+                    sold_revenue[accepted, i, increment] += amount_recieved[accepted]
+
+        population.fill_solar_prod_forecast_increment(slice(None))
+        return trades
+
+    def exchange_no_storage_batch(self, traces=None):
+        """ 
+        Batched exchangeNoStorage() over every increment of the run. Each round 
+        pairs the i-th remaining buyer with the i-th remaining seller in every 
+        hour that is still trading, rounds repeat until no hour can trade. Fills 
+        are the same as those of exchangeNoStorage(). 
+
+        INPUT: 
+            traces (list of dict): optional per increment traces of the TimestepRecorder
+        """
+        population = self.population
+        wtp_arr = population.wtp
+        wta_arr = population.wta
+        buyer_priority = population.buyer_priority
+        seller_priority = population.seller_priority
+        wtp_ordered = wtp_arr[buyer_priority]
+        wta_ordered = wta_arr[seller_priority]
+
+        forecast_demand = population.forecast_demand_matrix
+        forecast_excess = population.forecast_excess_matrix
+        sold = self.ledger["sold"]
+        sold_revenue = self.ledger["sold_revenue"]
+        bought = self.ledger["bought"]
+        bought_expenditure = self.ledger["bought_expenditure"]
+
+        # Hours without buyers or sellers end after one round without trades
+        trading = population.market_possible.copy()
+        rounds = np.where(trading, 0, 1)
+        trades = np.zeros(self.number_increments, dtype=int)
+
+        while trading.any():
+            hours = np.flatnonzero(trading)
+            demand = np.maximum(forecast_demand[:, hours] - bought[:, hours], 0)
+            excess = np.maximum(forecast_excess[:, hours] - sold[:, hours], 0)
+
+            # Remaining buyers and sellers of every hour, in price priority order
+            buyer_active = demand[buyer_priority] > 0
+            seller_active = excess[seller_priority] > 0
+            buyer_count = buyer_active.sum(axis=0)
+            seller_count = seller_active.sum(axis=0)
+
+            # Hours stop after this round if either side is empty, or the best 
+            # buyer does not pay the best seller's WTA
+            best_wtp = wtp_ordered[np.argmax(buyer_active, axis=0)]
+            best_wta = wta_ordered[np.argmax(seller_active, axis=0)]
+            continuing = (buyer_count > 0) & (seller_count > 0) & (best_wtp >= best_wta)
+
+            # Rank of every remaining trader within its hour, the rank-i buyer 
+            # is matched with the rank-i seller
+            buyer_position, buyer_column = np.nonzero(buyer_active)
+            buyer_rank = (np.cumsum(buyer_active, axis=0) - 1)[buyer_position, buyer_column]
+            seller_position, seller_column = np.nonzero(seller_active)
+            seller_rank = (np.cumsum(seller_active, axis=0) - 1)[seller_position, seller_column]
+
+            seller_by_rank = np.zeros(demand.shape, dtype=int)
+            seller_by_rank[seller_rank, seller_column] = seller_priority[seller_position]
+
+            paired = buyer_rank < seller_count[buyer_column]
+            column = buyer_column[paired]
+            buyers_matched = buyer_priority[buyer_position[paired]]
+            sellers_matched = seller_by_rank[buyer_rank[paired], column]
+            buyer_wtp = wtp_arr[buyers_matched]
+
+            # Exchange Amount in units of kWh
+            exchange_amount = np.where(wta_arr[sellers_matched] <= buyer_wtp,
+                                       np.minimum(excess[sellers_matched, column], demand[buyers_matched, column]), 0)
+            traded = exchange_amount > 0
+            traded_hours = hours[column[traded]]
+            buyers_matched = buyers_matched[traded]
+            sellers_matched = sellers_matched[traded]
+            exchange_amount = exchange_amount[traded]
+            payment = buyer_wtp[traded] * exchange_amount
+
+            # every (house, hour) appears at most once per round
+            sold[sellers_matched, traded_hours] += exchange_amount
+            sold_revenue[sellers_matched, traded_hours] += payment
+            bought[buyers_matched, traded_hours] += exchange_amount
+            bought_expenditure[buyers_matched, traded_hours] += payment
+
+            trades += np.bincount(traded_hours, minlength=self.number_increments)
+            rounds[hours] += 1
+            trading[hours[~continuing]] = False
+
+        if traces is not None:
+            demand = np.maximum(forecast_demand - bought, 0)
+            excess = np.maximum(forecast_excess - sold, 0)
+            for increment, trace in enumerate(traces):
+                trace["rounds"] = rounds[increment]
+                trace["trades"] = trades[increment]
+                status = trace["trade_status"]
+                status[bought[:, increment] > 0] = BOUGHT
+                status[sold[:, increment] > 0] = SOLD
+                status[demand[:, increment] > 0] = BUY_REJECTED
+                status[excess[:, increment] > 0] = SELL_REJECTED
+                trace["rejections"] = int(np.count_nonzero(demand[:, increment] > 0) + np.count_nonzero(excess[:, increment] > 0))
+
+        population.fill_solar_prod_forecast_increment(slice(None))
+
+    def determine_amm_liquidity(self, equilibrium_price, k=None):
         """ 
         determines the amount of money tokens (x tokens) and 
         energy tokens (y tokens) that the protocol should be initialized with 
@@ -393,17 +821,15 @@ class Market:
 
         INPUT: 
             equilibrium_price
+            k (float or np arr): liquidity, amm_liquidity_k of the config if None
         RETURN: 
             x_token_amt (float), y_token_amt (float)
             
         """
-        k = self.sim_config["amm_liquidity_k"]
+        if k is None:
+            k = self.sim_config["amm_liquidity_k"]
         
-        y_token_amt = np.sqrt(k/equilibrium_price)
-
-        x_token_amt = y_token_amt * equilibrium_price
-
-        return x_token_amt, y_token_amt
+        return liquidity_reserves(equilibrium_price, k)
 
     def tally_op_sf_hh(self):
         """
@@ -413,7 +839,10 @@ class Market:
         is called, which calculates the Actual Production for prosumers and their 
         actual overproduction and shortfall during each timestep. 
 
-        This has been copied from the original model and is extremely inefficient. 
+        The daytime flag of an increment (any prosumer producing during any of 
+        its minutes) is a mask precomputed by the HouseholdPopulation, and every 
+        other quantity is derived for all houses and increments at once as 
+        whole-array operations on the population's matrices. 
 
         NOTE: throughout the solar production and demand determination calculations 
         the magic numbers /1000 and /60 appear. The /1000 converts the watts/hour 
@@ -427,292 +856,132 @@ class Market:
         RETURN: 
             NONe 
         """
-        #Iterates over each house and calculates various parameters 
-        for i in range(self.number_houses):
-            #This loop looks at each time step (one hour) within the model
-            for j in range(self.number_increments):
-
-                #The code below is used to check if the current increment falls
-                #under daytime, if it does, we set daytime to true later 
-                daytime = False
-                for z in range(self.number_houses):
-                    for w in range(self.increment):
-                        if self.households[z].has_pv and (self.households[z].get_solar_production((j * self.increment) + w) > 0.0):
-                            daytime = True
-                
-                #Calculating, Actual Demand and Energy produced during each time step (hour)
-                actual_demand = 0.0
-                actual_production = 0.0
-
-                #Since increment is 60, for a given hour, the consumer demand data 
-                #and solar production data is integrated/summed to find 
-                #actual demand or production for the given hour 
-                #The /1000 converts the 
-                for k in range(self.increment):
-                    actual_demand += ((self.households[i].get_electricity_use((j * self.increment) + k)) / 1000.0) / 60.0
-                    if daytime: #separate variable that is being tracked
-                        self.daytime_demand[i][j] += ((self.households[i].get_electricity_use((j * self.increment) + k)) / 1000.0) / 60.0
-                    if self.households[i].has_pv: #don't care about production otherwise
-                        actual_production += ((self.households[i].get_solar_production((j * self.increment) + k)) / 1000.0) / 60.0
-                
-                #Actual production of consumer and prosumer houses
-                self.households[i].production[j] = actual_production
-                #Actual demand of consumer and prosumer houses
-                self.households[i].demand[j] = actual_demand
-
-                #variables tracked in exchangNoStorage()
-                #they track the amounts of energy bought and sold by different
-                #households each time step (hour)
-                sold = self.seller_history[i][j][0]
-                bought = self.buyer_history[i][j][0]
-                #value is used to track over production 
-                value = actual_production - actual_demand - sold
-                actual_excess = 0.0
-
-                #calculating the difference between 
-                if (actual_production - actual_demand) > 0:
-                    actual_excess = actual_production - actual_demand
-                    self.households[i].production_for_demand[j] = actual_demand
-                    self.households[i].production_after_demand[j] = actual_production - actual_demand
-                else: #useless variables to log for non pv-producers, uncertain why it is being tracked
-                    self.households[i].production_for_demand[j] = actual_production
-                    self.households[i].production_after_demand[j] = 0
-
-
-                self.excess_solar[i][j] = actual_excess
-                
-                # This piece of code calculates the overproduction, amount sold to utility provider
-                # 
-                if self.households[i].has_pv and sold > 0.0:
-                    if value > 0:
-                        self.overproduction[i][j] = value
-                        self.households[i].production_for_utility[j] = value
-                        self.households[i].production_for_market[j] = sold
-                    else:
-                        self.shortfall[i][j] = -value
-                        self.households[i].production_for_utility[j] = 0.0
-                        self.households[i].production_for_market[j] = sold + value
-                        if (sold + value) < 0:
-                            self.households[i].production_for_market[j] = 0.0
-                elif self.households[i].has_pv and sold == 0 and bought == 0:
-                    if value > 0:
-                        self.overproduction[i][j] = value
-                        self.households[i].production_for_utility[j] = value
-                        self.households[i].production_for_market[j] = 0.0
-                    else:
-                        self.shortfall[i][j] = 0
-                        self.households[i].production_for_utility[j] = 0.0
-                        self.households[i].production_for_market[j] = 0.0
-                else:
-                    if value > 0:
-                        self.overproduction[i][j] = value
-                        self.households[i].production_for_utility[j] = value
-                        self.households[i].production_for_market[j] = 0.0
-                    else:
-                        self.shortfall[i][j] = 0
-                        self.households[i].production_for_utility[j] = 0.0
-                        self.households[i].production_for_market[j] = 0.0
-
-                # print(f"Household : {i}, time step {j}, actual_demand = {actual_demand} actual_production = {actual_production} \
-                #       actual_excess = {actual_excess} bought = {bought} sold = {sold}  value = {value}")
-                
+        population = self.population
+        has_pv = population.has_pv
+        daytime = population.daytime
+
+        #Actual demand and production of every house for every increment, the 
+        #minutely data summed over each increment (production only for prosumers)
+        actual_demand = population.demand
+        actual_production = population.production
+
+        daytime_demand = np.where(daytime[None, :], actual_demand, 0.0)
+
+        #variables tracked in exchangNoStorage()
+        #they track the amounts of energy bought and sold by different
+        #households each time step (hour)
+        sold = self.ledger["sold"]
+        bought = self.ledger["bought"]
+        #value is used to track over production 
+        value = actual_production - actual_demand - sold
+        surplus = actual_production - actual_demand
+
+        actual_excess = np.where(surplus > 0, surplus, 0.0)
+        production_for_demand = np.where(surplus > 0, actual_demand, actual_production)
+        production_after_demand = np.where(surplus > 0, surplus, 0.0)
+
+        # This piece of code calculates the overproduction, amount sold to utility provider
+        # Prosumers that sold into the market cover a negative value as shortfall, 
+        # everyone else (no trades or buyers) only logs positive overproduction 
+        market_seller = has_pv[:, None] & (sold > 0.0)
+        overproduction = np.where(value > 0, value, 0.0)
+        production_for_utility = overproduction
+        shortfall = np.where(market_seller & (value <= 0), -value, 0.0)
+        production_for_market = np.where(market_seller,
+                                         np.where(value > 0, sold, np.maximum(sold + value, 0.0)),
+                                         0.0)
+
+        #written in place, the households' arrays are rows of these matrices
+        population.production_for_demand[...] = production_for_demand
+        population.production_after_demand[...] = production_after_demand
+        population.production_for_utility[...] = production_for_utility
+        population.production_for_market[...] = production_for_market
+
+        self.ledger["daytime_demand"] = daytime_demand
+        self.ledger["excess_solar"] = actual_excess
+        self.ledger["overproduction"] = overproduction
+        self.ledger["shortfall"] = shortfall
         
     def tally_op_sf_totals(self): 
         """ 
         Based on the Monroe et. al model, tally's the aggregate values 
         for the entire simulation at the very end of the simulation.
 
-        NOTE: This is bad coding practice, all this information can be extracted 
-        out of agent level output, however, this is more true to the original 
-        code bits and pieces translated by chatgpt and verified by me. 
-        The refactoring of this code would be an overhaul of a lot of this stuff. 
+        All the totals are array reductions over the ledger and the household 
+        matrices, see abm.aggregate.reduce_aggregates(). 
 
         INPUT: 
             None
 
         Return: 
-            Updates all the class variables that are related with the totals 
+            record (AggregateRecord): the aggregate values of the run. Also 
+                updates the seller price series class variables and appends 
+                the record to simulation_output/aggregate_sim_data.csv 
         """
-        
-        total_op = 0.0
-        total_sf = 0.0
-        total_bought = 0.0
-        total_bought_expenditure = 0.0
-        total_over_bought = 0.0
-        total_under_bought = 0.0
-        total_sold = 0.0
-        total_sold_revenue = 0.0
-        total_daytime_demand = 0.0
-        
-        total_production = 0.0
-        total_production_for_demand = 0.0
-        total_production_for_market = 0.0
-        total_production_for_utility = 0.0
-        
-        for i in range(self.number_houses):
-            for j in range(self.number_increments):
-                total_op += self.overproduction[i][j]
-                total_sf += self.shortfall[i][j]
-                total_bought += self.buyer_history[i][j][0]
-                total_sold += self.seller_history[i][j][0]
-                total_bought_expenditure += self.buyer_history[i][j][1]
-                total_sold_revenue += self.seller_history[i][j][1]
-                total_over_bought += self.overbought[i][j]
-                total_under_bought += self.underbought[i][j]
-                total_daytime_demand += self.daytime_demand[i][j]
-                
-                total_production += self.households[i].production[j]
-                total_production_for_demand += self.households[i].production_for_demand[j]
-                total_production_for_market += self.households[i].production_for_market[j]
-                total_production_for_utility += self.households[i].production_for_utility[j]
-        
-        total_monthly_excess = 0.0
-        for i in range(self.number_houses):
-            for j in range(self.number_increments):
-                total_monthly_excess += self.excess_solar[i][j]
-        
-        print("Total Overproduction =", total_op)
-        print("Total Shortfall =", total_sf)
-        print("Total Shortfall Penalties [$] =", total_sf * self.retail_rate)
-        print("Total Overproduction Revenue [$] =", total_op * self.avoided_fuel_cost_rate)
-        print("Total Sold Electricity [kWh] =", total_sold)
-        print("Total Sold Revenue [$] =", total_sold_revenue)
+        population = self.population
+
+        record = reduce_aggregates(
+            self.ledger,
+            has_pv=population.has_pv,
+            demand=population.demand,
+            production=population.production,
+            production_for_demand=population.production_for_demand,
+            production_for_market=population.production_for_market,
+            production_for_utility=population.production_for_utility,
+            retail_rate=self.retail_rate,
+            avoided_fuel_cost_rate=self.avoided_fuel_cost_rate,
+            simulation_name=self.simulation_name,
+            run_number=self.run_number,
+            prosumers=self.sim_config["prosumer_count"],
+            perfect_forecasting=self.perfect_forecasting,
+            exchange_type=self.sim_config["exchange_type"],
+            amm_liquidity_k=self.sim_config["amm_liquidity_k"],
+        )
+
+        self.interval_average_seller_price = record.interval_average_seller_price
+        self.running_average_seller_price = record.running_average_seller_price
+
+        print("Total Overproduction =", record.total_overproduction)
+        print("Total Shortfall =", record.total_shortfall)
+        print("Total Shortfall Penalties [$] =", record.total_shortfall * self.retail_rate)
+        print("Total Overproduction Revenue [$] =", record.total_overproduction * self.avoided_fuel_cost_rate)
+        print("Total Sold Electricity [kWh] =", record.total_sold)
+        print("Total Sold Revenue [$] =", record.total_sold_revenue)
         
         print()
-        print("Total Production =", total_production)
-        print("Total Production For Demand =", total_production_for_demand)
-        print("Total Production For Market =", total_production_for_market)
-        print("Total Production For Utility =", total_production_for_utility)
-        print("Demand + Market + Utility =", total_production_for_demand + total_production_for_market + total_production_for_utility)
+        print("Total Production =", record.total_production)
+        print("Total Production For Demand =", record.total_production_for_demand)
+        print("Total Production For Market =", record.total_production_for_market)
+        print("Total Production For Utility =", record.total_production_for_utility)
+        print("Demand + Market + Utility =", record.total_production_for_demand + record.total_production_for_market + record.total_production_for_utility)
         
-        seller_avg_price = (total_sold_revenue - (total_sf * self.retail_rate) + (total_op * self.avoided_fuel_cost_rate)) / (total_production_for_market + total_production_for_utility)
-        
-        proportion_to_market = total_production_for_market / total_production
-        proportion_excess_sold = total_production_for_market / (total_production_for_market + total_production_for_utility)
-        
-        total_monthly_demand = 0.0
-        for i in range(self.number_houses):
-            for j in range(self.minutes_in_month):
-                total_monthly_demand += self.households[i].get_electricity_use(j) / 1000.0 / 60.0
         print()
-        print("Total Monthly Demand [kWh] =", total_monthly_demand)
-        
-        print("Total Monthly Excess [kWh] =", total_monthly_excess)
-        
-        running_rev = 0.0
-        running_energy = 0.0
-        running_op = 0.0
-        running_sf = 0.0
-        running_actual_production = 0.0
-        
-        running_total_excess = 0.0
-        for i in range(self.number_increments):
-            revenue = 0.0
-            short_fall = 0.0
-            over_production = 0.0
-            sold_energy = 0.0
-            
-            interval_excess = 0.0
-            for j in range(self.number_houses):
-                if self.seller_history[j][i][0] > 10000.0:
-                    sold_energy += 0
-                    running_energy += 0
-                    running_rev += 0
-                    revenue += 0
-                else:
-                    sold_energy += self.seller_history[j][i][0]
-                    running_energy += self.seller_history[j][i][0]
-                    running_rev += self.seller_history[j][i][1]
-                    revenue += self.seller_history[j][i][1]
-                running_op += self.overproduction[j][i]
-                over_production += self.overproduction[j][i]
-                running_sf += self.shortfall[j][i]
-                short_fall += self.shortfall[j][i]
-                
-                interval_excess += self.excess_solar[j][i]
-                running_total_excess += self.excess_solar[j][i]
-            
-            if interval_excess > 0: 
-                self.interval_average_seller_price[i] = (revenue - (short_fall * self.retail_rate) + (over_production * self.avoided_fuel_cost_rate)) / interval_excess
-            else: 
-                self.interval_average_seller_price[i] = 0
-            
-            if running_total_excess > 0: 
-                self.running_average_seller_price[i] = (running_rev - (running_sf * self.retail_rate) + (running_op * self.avoided_fuel_cost_rate)) / running_total_excess
-            else: 
-                self.running_average_seller_price[i]
+        print("Total Monthly Demand [kWh] =", record.total_monthly_demand)
+        print("Total Monthly Excess [kWh] =", record.total_monthly_excess)
 
-            
-        for i in range(self.number_houses):
-            for j in range(self.minutes_in_month):
-                if self.households[i].has_pv:
-                    running_actual_production += self.households[i].get_solar_production(j) / 1000.0 / 60.0
-        
-        temp = (running_energy - running_sf) / running_actual_production
-
-        #print("(Energy Sold - Total ShortFall) / Energy Produced =", temp)
-        print("Running Energy Sold =", running_energy)
-        print("Running Actual Production =", running_actual_production)
-        print("Total Shortfall =", running_sf)
+        print("Running Energy Sold =", record.running_energy_sold)
+        print("Running Actual Production =", record.running_actual_production)
+        print("Total Shortfall =", record.total_shortfall)
         
-        print("Seller Average Price [$/kWh] =", seller_avg_price)
-        print("Proportion of Total Production Sold into Market =", proportion_to_market)
-        print("Proportion of Excess Sold into Market =", proportion_excess_sold)
-        print("Total Daytime Demand [kWh] =", total_daytime_demand)
-        
-        print("Total Production For Market =", total_production_for_market)
-        print("Total Production For Utility =", total_production_for_utility)
-        print("Total Production For Demand =", total_production_for_demand)
-    
-        system_demand = np.zeros(self.number_increments)
-        system_production = np.zeros(self.number_increments)
+        print("Seller Average Price [$/kWh] =", record.seller_average_price)
+        print("Proportion of Total Production Sold into Market =", record.proportion_to_market)
+        print("Proportion of Excess Sold into Market =", record.proportion_excess_sold)
+        print("Total Daytime Demand [kWh] =", record.total_daytime_demand)
         
-        for i in range(self.number_houses):
-            for j in range(self.number_increments):
-                system_demand[j] += self.households[i].demand[j]
-                if self.households[i].has_pv:
-                    system_production[j] += self.households[i].production[j]
+        print("Total Production For Market =", record.total_production_for_market)
+        print("Total Production For Utility =", record.total_production_for_utility)
+        print("Total Production For Demand =", record.total_production_for_demand)
 
-        system_demand_total = np.sum(system_demand)
-        system_production_total = np.sum(system_production)
+        print("Total System Demand = ", record.total_system_demand)
+        print("Total System Production = ", record.total_system_production)
 
-        print("Total System Demand = ", system_demand_total)
-        print("Total System Production = ", system_production_total)
 
+        # Handing the totals to the results sink, which owns the file I/O
+        if self.write_output:
+            sink = self.sink if self.sink is not None else default_sink()
+            sink.emit(record)
 
-        # Determine the path for the CSV file
-        dir_path = os.path.dirname(os.path.realpath(__file__))
-        output_path = os.path.join(dir_path, '..', 'simulation_output', 'aggregate_sim_data.csv')
-        output_path = os.path.normpath(output_path)
-
-        # Appending the totals to a CSV file
-        file_exists = os.path.isfile(output_path)
-        with open(output_path, mode='a', newline='') as file:
-            writer = csv.writer(file)
-            if not file_exists:
-                # Write the header if the file does not exist
-                writer.writerow([
-                    'simulation_name','run_number', 'prosumers', 'perfect_forecasting', 'exchange_type', "amm_liquidity_k",
-                    'Total Overproduction', 'Total Shortfall', 'Total Bought', 'Total Bought Expenditure',
-                    'Total Over Bought', 'Total Under Bought', 'Total Sold', 'Total Sold Revenue',
-                    'Total Daytime Demand', 'Total Production', 'Total Production for Demand',
-                    'Total Production for Market', 'Total Production for Utility', 'Running Energy Sold',
-                    'Running Actual Production', 'Seller Average Price', 'Proportion of Total Production Sold into Market',
-                    'Proportion of Excess Sold into Market', 'Total System Demand', 'Total System Production'
-                ])
-            # Write the totals
-            writer.writerow([
-                self.simulation_name, self.run_number, self.sim_config["prosumer_count"], self.perfect_forecasting, 
-                self.sim_config["exchange_type"], self.sim_config["amm_liquidity_k"],
-                total_op, total_sf, total_bought, total_bought_expenditure, total_over_bought,
-                total_under_bought, total_sold, total_sold_revenue, total_daytime_demand, total_production,
-                total_production_for_demand, total_production_for_market, total_production_for_utility,
-                running_energy, running_actual_production, seller_avg_price, proportion_to_market,
-                proportion_excess_sold, system_demand_total, system_production_total
-            ])
-
-
-            
+        return record
 
 
     def exchangeNoStorage(self):
@@ -720,6 +989,11 @@ class Market:
         Bilateral exchange method with no storage, adopted from the Monroe et. al 
         model. Called each timestep (hour) within the simulation to execute exchange
         between prosumers and consumers.  
+
+        Each round pairs the i-th remaining buyer (by WTP) with the i-th remaining 
+        seller (by WTA) and fills all pairs at once with array operations, rounds 
+        repeat until no pair can trade. The priority order is computed once per 
+        run by the HouseholdPopulation.
         
         INPUT: 
             None 
@@ -728,92 +1002,70 @@ class Market:
 
         """
         
+        population = self.population
+        increment = self.current_increment - 1
+        trace = self.increment_trace
+        wtp_arr = population.wtp
+        wta_arr = population.wta
+
+        # Ledger columns of this increment, views, so the fills below write into the ledger
+        sold = self.ledger.get_increment("sold", increment)
+        sold_revenue = self.ledger.get_increment("sold_revenue", increment)
+        bought = self.ledger.get_increment("bought", increment)
+        bought_expenditure = self.ledger.get_increment("bought_expenditure", increment)
+
         continuation_flag = True #Tracks if the ending condition is met
         current_round = 0 #number of rounds of trading 
 
         while continuation_flag:
-            excess = np.zeros(self.number_houses)
-            demand = np.zeros(self.number_houses)
-
-            #print(f"Exchange No Storage: current_round = {current_round}")
-            for i in range(self.number_houses):
-                #print(f"-"*5, f"Household: {i}",f"-"*5)
+            demand = np.maximum(population.forecast_demand(increment) - bought, 0)
+            excess = np.maximum(population.forecast_excess(increment) - sold, 0)
 
-                household = self.households[i]
-                
-                demand[i] = max(household.forecast_demand_no_storage_simple() - self.buyer_history[i][self.current_increment - 1][0], 0)
-                excess[i] = max(household.forecast_excess_no_storage_simple() - self.seller_history[i][self.current_increment - 1][0], 0)
-                
-            # print(f"demand : {demand}")
-            # print(f"excess : {excess}")
-           
-            # Boolean flag for zero demand
-            zero_demand = np.all(demand <= 0)
-            if zero_demand:
-                continuation_flag = False
+            # Buyers and sellers still in the market, in the price priority order 
+            # precomputed for the run (highest WTP / lowest WTA first)
+            buyers_ordered = population.buyer_priority[demand[population.buyer_priority] > 0]
+            sellers_ordered = population.seller_priority[excess[population.seller_priority] > 0]
 
-            # Boolean flag for zero excess
-            zero_excess = np.all(excess <= 0)
-            if zero_excess:
-                #print(f"zero excess shutting down now")
+            # The round ends trading if either side is empty, or the best buyer 
+            # does not pay the best seller's WTA
+            if len(buyers_ordered) == 0 or len(sellers_ordered) == 0 or wtp_arr[buyers_ordered[0]] < wta_arr[sellers_ordered[0]]:
                 continuation_flag = False
 
-            
-            buyer_index = np.where(demand > 0)[0]
-            seller_index = np.where(excess > 0)[0]
-
-            # Order buyers by willingness to pay (WTP)
-            buyers_ordered = sorted(buyer_index, key=lambda x: self.households[x].get_wtp(), reverse=True)
-
-            # Order sellers by willingness to accept (WTA)
-            sellers_ordered = sorted(seller_index, key=lambda x: self.households[x].get_wta())
-
+            # The i-th buyer is matched with the i-th seller, every house trades 
+            # at most once per round so the fills are independent
             total_exchanges = min(len(buyers_ordered), len(sellers_ordered))
-
-            # print(f"buyers_ordered = {buyers_ordered}")
-            # print(f"sellers = {sellers_ordered}")
-            # print(f"total_exchanges = {total_exchanges}")
-           
-            # Boolean flag to check WTA and WTP of first paired traders
-            if not buyers_ordered or not sellers_ordered or self.households[buyers_ordered[0]].get_wtp() < self.households[sellers_ordered[0]].get_wta():
-                continuation_flag = False
-            # try:
-            #     print(f"wtp arr = {self.households[buyers_ordered[0]].get_wtp()}")
-            #     print(f"wta arr = {self.households[sellers_ordered[0]].get_wta()}")
-            # except: 
-            #     print(f"buyers_ordered or sellers_ordered empty")
-            #     print(f"continuation_flag = {continuation_flag}")
-
-            # print(f"-"*5, f"Exchange Time", f"-"*5)
-            for i in range(total_exchanges):
-                #print(f"Match number : {i + 1}")
-                seller_index2 = sellers_ordered[i]
-                buyer_index2 = buyers_ordered[i]
-
-                seller_wta = self.households[seller_index2].get_wta()
-                buyer_wtp = self.households[buyer_index2].get_wtp()
-                seller_cap = excess[seller_index2]
-                buyer_need = demand[buyer_index2]
-                
-                # Exchange Amount in units of kWh
-                exchange_amount = min(seller_cap, buyer_need) if seller_wta <= buyer_wtp else 0
-
-                # print(f"seller_index2 = {seller_index2}, buyer_index2 = {buyer_index2}")
-                # print(f"seller_wta = {seller_wta}, buyer_wtp = {buyer_wtp}")
-                # print(f"seller_cap = {seller_cap}, buyer_need = {buyer_need}")
-                # print(f"exchange_amount = {exchange_amount}, amount paid = {exchange_amount * buyer_wtp}")
-
-                if exchange_amount > 0:
-                    #print(f"Trade Sucessful")
-                    self.seller_history[seller_index2][self.current_increment - 1][0] += exchange_amount
-                    self.seller_history[seller_index2][self.current_increment - 1][1] += buyer_wtp * exchange_amount
-                    self.buyer_history[buyer_index2][self.current_increment - 1][0] += exchange_amount
-                    self.buyer_history[buyer_index2][self.current_increment - 1][1] += buyer_wtp * exchange_amount
+            buyers_matched = buyers_ordered[:total_exchanges]
+            sellers_matched = sellers_ordered[:total_exchanges]
+            buyer_wtp = wtp_arr[buyers_matched]
+
+            # Exchange Amount in units of kWh
+            exchange_amount = np.where(wta_arr[sellers_matched] <= buyer_wtp,
+                                       np.minimum(excess[sellers_matched], demand[buyers_matched]), 0)
+            traded = exchange_amount > 0
+            buyers_matched = buyers_matched[traded]
+            sellers_matched = sellers_matched[traded]
+            exchange_amount = exchange_amount[traded]
+            payment = buyer_wtp[traded] * exchange_amount
+
+            sold[sellers_matched] += exchange_amount
+            sold_revenue[sellers_matched] += payment
+            bought[buyers_matched] += exchange_amount
+            bought_expenditure[buyers_matched] += payment
+            if trace is not None:
+                trace["trades"] += len(exchange_amount)
 
             current_round += 1
 
-        for i in range(self.number_houses):
-            self.households[i].fill_solar_prod_forecast_increment()
+        if trace is not None:
+            #houses that traded, and houses whose order was left (partly) unfilled
+            trace["rounds"] = current_round
+            trace["trade_status"][bought > 0] = BOUGHT
+            trace["trade_status"][sold > 0] = SOLD
+            trace["trade_status"][demand > 0] = BUY_REJECTED
+            trace["trade_status"][excess > 0] = SELL_REJECTED
+            trace["rejections"] = int(np.count_nonzero(demand > 0) + np.count_nonzero(excess > 0))
+
+        population.fill_solar_prod_forecast_increment(increment)
 
 
     def adjustIrradiance(self, irradianceArray):
@@ -825,83 +1077,51 @@ class Market:
             irradianceArray (np arr): one dimensional minutely solar irradience 
                                      array of length equivalant to minutes in a
                                      month. 
+
+        NOTE: the solar geometry is computed as array operations for the 
+        whole month and memoized by abm.solar, so only the first Market in 
+        a process pays for it. 
         """
 
-        declination = np.zeros(self.minutes_in_month)
-        hourAngle = np.zeros(self.minutes_in_month)
-        altitudeAngle = np.zeros(self.minutes_in_month)
-        solarAzimuth = np.zeros(self.minutes_in_month)
-        C = np.zeros(self.minutes_in_month)
-        incidenceAngle = np.zeros(self.minutes_in_month)
-        beamRad = np.zeros(self.minutes_in_month)
-        diffuseRad = np.zeros(self.minutes_in_month)
-        reflectedRad = np.zeros(self.minutes_in_month)
-        collectorRad = np.zeros(self.minutes_in_month)
-
-        for i in range(self.days_in_month):
-            currentDeclination = 23.45 * math.sin(math.radians((360/365) * (self.begin_month_day + i)))
-            minuteOfSolarNoon = self.solarNoon(self.begin_month_day + i)
-            currentC = 0.095 + (0.04 * math.sin(math.radians((360/365) * (self.begin_month_day + i - 100))))
-
-            for j in range(1440): #minutes in one day = 60*24 = 1440  
-                currentMinute = (1440 * i) + j
-                declination[currentMinute] = currentDeclination
-                minutesFromSolarNoon = (minuteOfSolarNoon - j)
-                hourAngle[currentMinute] = (minutesFromSolarNoon / 60.0) * 15.0
-                altitudeAngle[currentMinute] = math.degrees(math.asin(math.cos(math.radians(self.latitude)) * 
-                                            math.cos(math.radians(declination[currentMinute])) * 
-                                            math.cos(math.radians(hourAngle[currentMinute])) + 
-                                            (math.sin(math.radians(self.latitude)) * 
-                                             math.sin(math.radians(declination[currentMinute])))))
-                solarAzimuth[currentMinute] = math.degrees(math.asin((math.cos(math.radians(declination[currentMinute])) * 
-                                          math.sin(math.radians(hourAngle[currentMinute])))/
-                                          (math.cos(math.radians(altitudeAngle[currentMinute])))))
-                incidenceAngle[currentMinute] = math.degrees(math.acos(math.cos(math.radians(altitudeAngle[currentMinute])) * 
-                                           math.cos(math.radians(solarAzimuth[currentMinute])) * 
-                                           math.sin(math.radians(self.latitude)) + 
-                                           (math.sin(math.radians(altitudeAngle[currentMinute])) * 
-                                            math.cos(math.radians(self.latitude)))))
-                C[currentMinute] = currentC
-                beamRad[currentMinute] = irradianceArray[currentMinute] * math.cos(math.radians(incidenceAngle[currentMinute]))
-                diffuseRad[currentMinute] = irradianceArray[currentMinute] * currentC * ((1 + math.cos(math.radians(self.latitude))) / 2)
-                reflectedRad[currentMinute] = irradianceArray[currentMinute] * 0.2 * (currentC + math.sin(math.radians(altitudeAngle[currentMinute]))) * ((1 - math.cos(math.radians(self.latitude))) / 2)
-                collectorRad[currentMinute] = beamRad[currentMinute] + diffuseRad[currentMinute] + reflectedRad[currentMinute]
+        geometry = solar_geometry(self.latitude, self.longitude, self.local_time_meridian,
+                                  self.begin_month_day, self.days_in_month,
+                                  self.observe_daylight_savings)
+        collectorRad = collector_radiation(irradianceArray, geometry, self.latitude)
 
         return collectorRad
 
 
-    def solarNoon(self, n):
+    def run_streams(self):
         """ 
-        Calculates the minute at which the solar noon occurs for a given day. 
-        For instance, the day has 24*60 = 1440 minutes, and the solar noon can 
-        occur at 12 pm or 720th minute of the day. Therefore the following code 
-        would return 720: 
-
-        Input: 
-            n (int): nth day of the year, if the month is september then it 
-                    ranges from 244 - 274 (30 days). 
+        Returns the (forecast noise, amm bid order) random streams of the run. 
+
+        With a "seed" in the config both are independent numpy Generators 
+        spawned from SeedSequence([seed, run_number]). They depend on nothing 
+        else, so every configuration with the same seed sees the same noise and 
+        bid orders in its run n (common random numbers): configurations that 
+        only differ in amm_liquidity_k are compared on identical randomness. 
+        The number of bid orders drawn does not depend on k either, an order is 
+        drawn in every increment where a market is possible. 
+
+        Without a seed the noise generator is seeded from numpy's global 
+        random state and bid_rng is None, the bids are shuffled with the 
+        random module as before. 
+        """
+        seed = self.sim_config.get("seed")
+        if seed is None:
+            return np.random.default_rng(np.random.randint(0, 2**32, size=4, dtype=np.uint64)), None
+        noise_seed, bid_seed = np.random.SeedSequence([seed, self.run_number]).spawn(2)
+        return np.random.default_rng(noise_seed), np.random.default_rng(bid_seed)
 
-        RETURN: 
-            minute (int): minute at which the actual solar noon occurs. 
-        
+    def bid_order(self):
+        """ 
+        Random order in which the households bid into an increment's AMM pool. 
         """
-        if self.observe_daylight_savings and (69 <= n <= 307):
-            self.day_light_savings = True
-        else:
-            self.day_light_savings = False
-
-        longitudeCorrection = 4.0 * (self.local_time_meridian - self.longitude)  # Units of minutes
-        Bdegrees = (360.0/364.0) * (n - 81)
-        Bradians = math.radians(Bdegrees)
-        E = (9.87 * math.sin(2 * Bradians)) - (7.53 * math.cos(Bradians)) - (1.5 * math.sin(Bradians))  # Units of minutes
-        minutesFromClockNoon = -longitudeCorrection - E
-        minutesFromClockNoonInt = int(round(minutesFromClockNoon))
-        
-        if self.day_light_savings:
-            return (13 * 60) + minutesFromClockNoonInt
-        else:
-            return (12 * 60) + minutesFromClockNoonInt
-        
+        if self.bid_rng is not None:
+            return self.bid_rng.permutation(self.number_houses).tolist()
+        household_index_list = list(range(self.number_houses))
+        random.shuffle(household_index_list) #shuffle the list in place
+        return household_index_list
 
     def load_data_file(self, filename):
         """ 
@@ -929,4 +1149,20 @@ class Market:
         data = pd.read_csv(full_path)
         return data
 
+    def load_data_array(self, filename):
+        """ 
+        loads the single data column of a .csv datafile from under the data 
+        folder as a read-only, memory-mapped numpy array. The csv is converted 
+        to a versioned .npy file next to it on first use and reconverted when 
+        the source changes, so runs after the first skip csv parsing. 
+
+        INPUT: 
+            filename (str): the str filename of the data file without the 
+                            extension
+        
+        RETURN: 
+            data (np memmap): one dimensional read-only array
+        """
+        return load_data_array(filename)
+
 
@@ -0,0 +1,231 @@
+import os
+
+import numpy as np
+
+from abm.amm import LeanAMM, ScenarioPools, BUY, liquidity_reserves
+from abm.model import simulation_name
+
+
+# Run information stored with a trace
+METADATA_FIELDS = ("simulation_name", "run_number", "houses", "prosumers", "perfect_forecasting",
+                   "amm_liquidity_k", "amm_transaction_fee")
+
+
+class OrderFlowWriter:
+    """
+    Captures the order flow of an amm run: for every hour with a market, the
+    equilibrium price the pool was set up at and the orders the houses sent
+    in bid order, as (house, side, quantity, limit) where side is BUY or SELL
+    and the limit is the most a buyer pays or the least a seller accepts for
+    the whole quantity. Orders do not depend on the pool, so a trace can be
+    replayed against any pool (see replay()). close() writes the trace as
+    one compressed npz file.
+    """
+    def __init__(self, path, config=None, run_number=None):
+
+        self.path = path
+        self.metadata = {}
+        if config is not None:
+            self.metadata = {
+                "simulation_name": simulation_name(config),
+                "run_number": run_number,
+                "houses": len(config["household_params"]) if "household_params" in config else None,
+                "prosumers": config["prosumer_count"],
+                "perfect_forecasting": config["perfect_forecasting"],
+                "amm_liquidity_k": config.get("amm_liquidity_k"),
+                "amm_transaction_fee": config.get("amm_transaction_fee", 0),
+            }
+
+        self._increments = []
+        self._prices = []
+        self._orders = []
+        self.closed = False
+
+    def add_hour(self, increment, equilibrium_price, houses, sides, quantities, limits):
+        """
+        Captures the orders of one hour, see Market.amm_orders().
+        """
+        self._increments.append(increment)
+        self._prices.append(equilibrium_price)
+        self._orders.append((houses, sides, quantities, limits))
+
+    def close(self):
+        """
+        Writes the captured hours to path.
+        """
+        if self.closed:
+            return
+        counts = [len(houses) for houses, _, _, _ in self._orders]
+        columns = list(zip(*self._orders)) or [[], [], [], []]
+        arrays = {
+            "increment": np.array(self._increments, dtype=np.int32),
+            "equilibrium_price": np.array(self._prices, dtype=np.float64),
+            "hour_offsets": np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            "house": np.concatenate(columns[0] or [[]]).astype(np.int32),
+            "side": np.concatenate(columns[1] or [[]]).astype(np.int8),
+            "quantity": np.concatenate(columns[2] or [[]]).astype(np.float64),
+            "limit": np.concatenate(columns[3] or [[]]).astype(np.float64),
+        }
+        arrays.update({f"meta_{name}": np.array(value) for name, value in self.metadata.items()
+                       if value is not None})
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as trace_file:
+            np.savez_compressed(trace_file, **arrays)
+        os.replace(tmp_path, self.path)
+        self.closed = True
+
+
+class OrderFlow:
+    """
+    A captured order flow, read back with load_orderflow(). The orders of all
+    hours are stored back to back, the orders of hour h are
+    hour_offsets[h]:hour_offsets[h + 1].
+    """
+    def __init__(self, arrays):
+
+        self.increment = arrays["increment"]
+        self.equilibrium_price = arrays["equilibrium_price"]
+        self.hour_offsets = arrays["hour_offsets"]
+        self.house = arrays["house"]
+        self.side = arrays["side"]
+        self.quantity = arrays["quantity"]
+        self.limit = arrays["limit"]
+        self.metadata = {name: arrays[f"meta_{name}"].item() for name in METADATA_FIELDS
+                         if f"meta_{name}" in arrays}
+
+    def __len__(self):
+        return len(self.increment)
+
+    def hours(self):
+        """
+        Yields (increment, equilibrium price, houses, sides, quantities, limits) per hour.
+        """
+        for h in range(len(self.increment)):
+            orders = slice(self.hour_offsets[h], self.hour_offsets[h + 1])
+            yield (int(self.increment[h]), float(self.equilibrium_price[h]), self.house[orders],
+                   self.side[orders], self.quantity[orders], self.limit[orders])
+
+
+def load_orderflow(path):
+    """
+    Loads a trace written by an OrderFlowWriter.
+    """
+    with np.load(path) as trace_file:
+        return OrderFlow({name: trace_file[name] for name in trace_file.files})
+
+
+def check_houses(flow):
+    """
+    Raises ValueError if a stored house index is negative or, for traces that
+    record their population size, not below it.
+    """
+    if len(flow.house) == 0:
+        return
+    houses = flow.metadata.get("houses")
+    if flow.house.min() < 0 or (houses is not None and flow.house.max() >= houses):
+        raise ValueError(f"order flow house indices span {flow.house.min()}..{flow.house.max()}, "
+                         f"outside a population of {houses} houses")
+
+
+def _totals(flow, filled, amount):
+    """
+    Trade totals of replayed fills, amount is paid by buyers and received by sellers.
+    """
+    buy = flow.side == BUY
+    sold = np.sum(np.where(filled & ~buy, flow.quantity, 0.0), axis=-1)
+    sold_revenue = np.sum(np.where(filled & ~buy, amount, 0.0), axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        seller_average_price = sold_revenue / sold
+    return {
+        "bought": np.sum(np.where(filled & buy, flow.quantity, 0.0), axis=-1),
+        "bought_expenditure": np.sum(np.where(filled & buy, amount, 0.0), axis=-1),
+        "sold": sold,
+        "sold_revenue": sold_revenue,
+        "seller_average_price": seller_average_price,
+    }
+
+
+def replay(flow, liquidity_k=None, transaction_fee=0, amm_factory=None):
+    """
+    Feeds a captured order flow into a pool reset every hour, without building
+    any households. By default every hour's pool is set up like
+    Market.amm_exchange() does, from the captured equilibrium price and
+    liquidity_k, and each hour's orders go through LeanAMM.execute_batch() in the
+    captured order, so the fills equal those of the captured run for its own
+    k and fee.
+
+    INPUT:
+        flow (OrderFlow): trace from load_orderflow()
+        liquidity_k (float): amm_liquidity_k of the pools, that of the trace if None
+        transaction_fee (float): fee of the pools
+        amm_factory (callable): optional, called with the equilibrium price of
+                                an hour, returns the set up pool to use instead
+    RETURN:
+        result (dict): filled (orders,) bool and amount (orders,) paid or received
+                       per order, reserve_x / reserve_y (hours,) at the end of each
+                       hour, and the trade totals of _totals()
+    """
+    check_houses(flow)
+    if liquidity_k is None:
+        liquidity_k = flow.metadata["amm_liquidity_k"]
+
+    filled = np.zeros(len(flow.side), dtype=bool)
+    amount = np.zeros(len(flow.side))
+    reserve_x = np.zeros(len(flow))
+    reserve_y = np.zeros(len(flow))
+
+    pool = LeanAMM(transaction_fee)
+    for h, (_, price, _, sides, quantities, limits) in enumerate(flow.hours()):
+        if amm_factory is not None:
+            amm = amm_factory(price)
+        else:
+            x_token_amt, y_token_amt = liquidity_reserves(price, liquidity_k)
+            amm = pool
+            amm.setup_pool(quantity_x=x_token_amt, quantity_y=y_token_amt)
+
+        orders = slice(flow.hour_offsets[h], flow.hour_offsets[h + 1])
+        _, amount[orders], filled[orders], reserve_x[h], reserve_y[h] = amm.execute_batch(sides, quantities, limits)
+
+    result = {"filled": filled, "amount": amount, "reserve_x": reserve_x, "reserve_y": reserve_y}
+    result.update(_totals(flow, filled, amount))
+    return result
+
+
+def replay_scenarios(flow, liquidity_k, transaction_fee=0):
+    """
+    replay() for S pool scenarios at once with ScenarioPools, each order is
+    applied to all S pools of its hour in one step.
+
+    INPUT:
+        flow (OrderFlow): trace from load_orderflow()
+        liquidity_k, transaction_fee (float or np arr): (S,) pool parameters
+    RETURN:
+        result (dict): as replay(), with a leading scenario axis on every array
+    """
+    check_houses(flow)
+    liquidity_k, transaction_fee = np.broadcast_arrays(np.atleast_1d(np.asarray(liquidity_k, dtype=float)),
+                                                       np.asarray(transaction_fee, dtype=float))
+    scenarios = len(liquidity_k)
+    filled = np.zeros((scenarios, len(flow.side)), dtype=bool)
+    amount = np.zeros((scenarios, len(flow.side)))
+    reserve_x = np.zeros((scenarios, len(flow)))
+    reserve_y = np.zeros((scenarios, len(flow)))
+
+    pools = ScenarioPools(transaction_fee)
+    for h, (_, price, _, sides, quantities, limits) in enumerate(flow.hours()):
+        pools.setup_pools(*liquidity_reserves(price, liquidity_k))
+        start = flow.hour_offsets[h]
+        for j, (side, quantity, limit) in enumerate(zip(sides, quantities, limits), start):
+            if side == BUY:
+                filled[:, j], amount[:, j] = pools.buy_y_max_price(quantity, limit)
+            else:
+                filled[:, j], amount[:, j] = pools.sell_x_min_price(quantity, limit)
+        reserve_x[:, h] = pools.reserve_x
+        reserve_y[:, h] = pools.reserve_y
+
+    amount = np.where(filled, amount, 0.0)
+    result = {"filled": filled, "amount": amount, "reserve_x": reserve_x, "reserve_y": reserve_y}
+    result.update(_totals(flow, filled, amount))
+    return result
@@ -0,0 +1,189 @@
+import json
+import os
+
+import numpy as np
+
+
+# Trade status of a house in an increment, field trade_status
+NO_ORDER = 0
+BOUGHT = 1
+SOLD = 2
+BUY_REJECTED = -1
+SELL_REJECTED = -2
+
+# (field, dtype, fill value) recorded per house, every increment
+HOUSE_FIELDS = (
+    ("forecast_demand", np.float64, 0.0),
+    ("forecast_excess", np.float64, 0.0),
+    ("bought", np.float64, 0.0),
+    ("bought_expenditure", np.float64, 0.0),
+    ("sold", np.float64, 0.0),
+    ("sold_revenue", np.float64, 0.0),
+    ("trade_status", np.int8, NO_ORDER),
+)
+
+# (field, dtype, fill value) recorded once per increment. The amm fields are
+# nan for increments without a pool and for bilateral runs.
+INCREMENT_FIELDS = (
+    ("equilibrium_price", np.float64, np.nan),
+    ("amm_initial_x", np.float64, np.nan),
+    ("amm_initial_y", np.float64, np.nan),
+    ("amm_reserve_x", np.float64, np.nan),
+    ("amm_reserve_y", np.float64, np.nan),
+    ("trades", np.int32, 0),
+    ("rejections", np.int32, 0),
+    ("rounds", np.int32, 0),
+)
+
+MANIFEST_NAME = "manifest.json"
+
+
+class TimestepRecorder:
+    """
+    Streams the per increment state of one run to disk. Rows are buffered for
+    flush_every increments and then written as a shard directory holding one
+    .npy file per field, so memory use does not grow with the run length and
+    every shard can be memory-mapped when it is read back with load_recording().
+
+    The exchanges fill a trace (see new_trace()) with the increment's fields,
+    the per house trade amounts are taken from the ledger in record().
+    """
+    def __init__(self, output_dir, number_houses, flush_every=168):
+
+        self.output_dir = output_dir
+        self.number_houses = number_houses
+        self.flush_every = flush_every
+
+        self._house_buffers = {name: np.full((flush_every, number_houses), fill, dtype=dtype)
+                               for name, dtype, fill in HOUSE_FIELDS}
+        self._increment_buffers = {name: np.full(flush_every, fill, dtype=dtype)
+                                   for name, dtype, fill in INCREMENT_FIELDS}
+        self._increments = np.zeros(flush_every, dtype=np.int64)
+        self._rows = 0
+        self._shards = []
+        self.closed = False
+
+        os.makedirs(output_dir, exist_ok=True)
+
+    def new_trace(self):
+        """
+        Returns an empty trace for the next increment. The exchanges set the
+        increment fields as keys and mark houses in trace["trade_status"].
+        """
+        trace = {name: fill for name, _, fill in INCREMENT_FIELDS}
+        trace["trade_status"] = np.full(self.number_houses, NO_ORDER, dtype=np.int8)
+        return trace
+
+    def record(self, increment, trace, ledger, population):
+        """
+        Buffers the row of a finished increment and writes a shard once
+        flush_every rows are buffered.
+
+        INPUT:
+            increment (int): 0 based increment
+            trace (dict): filled trace of the increment, from new_trace()
+            ledger (TradeLedger): ledger of the run
+            population (HouseholdPopulation): households of the run
+        """
+        row = self._rows
+        self._increments[row] = increment
+
+        houses = self._house_buffers
+        houses["forecast_demand"][row] = population.forecast_demand(increment)
+        houses["forecast_excess"][row] = population.forecast_excess(increment)
+        for name in ("bought", "bought_expenditure", "sold", "sold_revenue"):
+            houses[name][row] = ledger.get_increment(name, increment)
+        houses["trade_status"][row] = trace["trade_status"]
+
+        for name, _, _ in INCREMENT_FIELDS:
+            self._increment_buffers[name][row] = trace[name]
+
+        self._rows += 1
+        if self._rows == self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows as a new shard and updates the manifest.
+        """
+        if self._rows == 0:
+            return
+        rows = self._rows
+        first = int(self._increments[0])
+        shard_name = f"shard_{len(self._shards):05d}"
+        shard_dir = os.path.join(self.output_dir, shard_name)
+        os.makedirs(shard_dir, exist_ok=True)
+
+        np.save(os.path.join(shard_dir, "increment.npy"), self._increments[:rows])
+        for buffers in (self._house_buffers, self._increment_buffers):
+            for name, buffer in buffers.items():
+                np.save(os.path.join(shard_dir, f"{name}.npy"), buffer[:rows])
+
+        self._shards.append({"name": shard_name, "first_increment": first, "rows": rows})
+        self._write_manifest()
+
+        #reset the buffers for the next shard
+        for buffers, fields in ((self._house_buffers, HOUSE_FIELDS), (self._increment_buffers, INCREMENT_FIELDS)):
+            for name, _, fill in fields:
+                buffers[name].fill(fill)
+        self._rows = 0
+
+    def close(self):
+        """
+        Writes the remaining rows and the final manifest.
+        """
+        if not self.closed:
+            self.flush()
+            self._write_manifest()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_manifest(self):
+        manifest = {
+            "number_houses": self.number_houses,
+            "house_fields": [name for name, _, _ in HOUSE_FIELDS],
+            "increment_fields": [name for name, _, _ in INCREMENT_FIELDS],
+            "shards": self._shards,
+        }
+        manifest_path = os.path.join(self.output_dir, MANIFEST_NAME)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(tmp_path, manifest_path)
+
+
+def iter_shards(output_dir, fields=None, mmap_mode='r'):
+    """
+    Yields the shards of a recording in increment order, as
+    (shard info, {field: array}) with the arrays memory-mapped by default.
+    """
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    if fields is None:
+        fields = ["increment"] + manifest["house_fields"] + manifest["increment_fields"]
+    for shard in manifest["shards"]:
+        shard_dir = os.path.join(output_dir, shard["name"])
+        yield shard, {name: np.load(os.path.join(shard_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in fields}
+
+
+def load_recording(output_dir, fields=None):
+    """
+    Loads a recording written by a TimestepRecorder.
+
+    INPUT:
+        output_dir (str): directory of the recording
+        fields (list of str): fields to load, all of them if None
+    RETURN:
+        recording (dict): {field: array}, (increments, houses) for the per house
+                          fields and (increments,) for the others
+    """
+    parts = {}
+    for _, arrays in iter_shards(output_dir, fields):
+        for name, array in arrays.items():
+            parts.setdefault(name, []).append(array)
+    return {name: np.concatenate(arrays) for name, arrays in parts.items()}
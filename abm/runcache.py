@@ -0,0 +1,196 @@
+import dataclasses
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from abm.aggregate import AggregateRecord
+from abm.datastore import INPUT_DATA_FILES, data_digest
+from abm.model import MODEL_VERSION, simulation_name
+
+
+DEFAULT_CACHE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                  '..', 'simulation_output', 'run_cache'))
+
+# Configuration keys that do not change the outcome of a run
+IGNORED_CONFIG_KEYS = {"n_runs", "household_params", "record_dir", "equilibrium_cache", "orderflow_dir",
+                       "amm_implementation", "verbose"}
+
+# Record fields describing which configuration and run a record belongs to,
+# these are taken from the requesting configuration on a cache hit
+RUN_INFO_FIELDS = ("simulation_name", "run_number", "prosumers", "perfect_forecasting",
+                   "exchange_type", "amm_liquidity_k")
+
+
+def effective_config(config):
+    """
+    Returns the part of a configuration that determines the outcome of a run.
+    amm_liquidity_k only matters for amm exchanges, so bilateral entries that
+    differ only in it map to the same runs. A zero amm_transaction_fee is the
+    default and dropped as well.
+    """
+    effective = {key: value for key, value in config.items() if key not in IGNORED_CONFIG_KEYS}
+    if effective.get("exchange_type") != "amm":
+        effective.pop("amm_liquidity_k", None)
+        effective.pop("amm_transaction_fee", None)
+    if not effective.get("amm_transaction_fee"):
+        effective.pop("amm_transaction_fee", None)
+    return effective
+
+
+class RunCache:
+    """
+    On-disk cache of run results, content addressed by a hash of everything a
+    run depends on: the effective configuration, the household params, the
+    digests of the input data, the seed / run number and MODEL_VERSION. Amm
+    runs without a seed are random and bypass the cache.
+
+    Each entry is a json file with the aggregate record, plus an optional npz
+    file with its time series. Entries are evicted least recently used first
+    once there are more than max_entries of them, checked every
+    evict_interval stores of this instance. Worker processes store into their
+    own copies, so the sweeps also call evict() in the parent once they finish.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=20000, evict_interval=100):
+
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.evict_interval = evict_interval
+        self._stores = 0
+        self._input_digests = None
+
+    def input_digests(self):
+        if self._input_digests is None:
+            self._input_digests = {filename: data_digest(filename) for filename in INPUT_DATA_FILES}
+        return self._input_digests
+
+    def key(self, config, run_number):
+        """
+        Returns the sha256 cache key of run run_number of config, None if the
+        run cannot be reproduced: an amm run without a seed shuffles its bids
+        from the global random state, so it is neither read nor stored.
+        """
+        if config.get("seed") is None and config.get("exchange_type") == "amm":
+            return None
+        payload = {
+            "model_version": MODEL_VERSION,
+            "config": effective_config(config),
+            "household_params": config.get("household_params"),
+            "input_data": self.input_digests(),
+            "seed": config.get("seed"),
+            "run_number": run_number,
+        }
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _paths(self, key):
+        entry_dir = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(entry_dir, f"{key}.json"), os.path.join(entry_dir, f"{key}.npz")
+
+    def get(self, config, run_number):
+        """
+        Returns the cached AggregateRecord of a run, or None on a miss. The
+        run info fields of the record are those of the requesting config.
+        """
+        key = self.key(config, run_number)
+        if key is None:
+            return None
+        json_path, npz_path = self._paths(key)
+        try:
+            with open(json_path, 'r') as entry_file:
+                values = json.load(entry_file)
+        except (OSError, ValueError):
+            return None
+
+        if os.path.isfile(npz_path):
+            with np.load(npz_path) as series:
+                values.update({name: series[name] for name in series.files})
+
+        values.update({
+            "simulation_name": simulation_name(config),
+            "run_number": run_number,
+            "prosumers": config["prosumer_count"],
+            "perfect_forecasting": config["perfect_forecasting"],
+            "exchange_type": config["exchange_type"],
+            "amm_liquidity_k": config.get("amm_liquidity_k"),
+        })
+
+        #mark as recently used
+        os.utime(json_path)
+        return AggregateRecord(**values)
+
+    def put(self, config, run_number, record, store_series=True):
+        """
+        Stores the AggregateRecord of a run and evicts old entries if needed.
+        """
+        key = self.key(config, run_number)
+        if key is None:
+            return
+        json_path, npz_path = self._paths(key)
+        os.makedirs(os.path.dirname(json_path), exist_ok=True)
+
+        values = {}
+        series = {}
+        for field in dataclasses.fields(record):
+            if field.name in RUN_INFO_FIELDS:
+                continue
+            value = getattr(record, field.name)
+            if isinstance(value, np.ndarray):
+                series[field.name] = value
+            else:
+                values[field.name] = value
+
+        tmp_suffix = f".{os.getpid()}.tmp"
+        if store_series and series:
+            with open(npz_path + tmp_suffix, 'wb') as npz_file:
+                np.savez(npz_file, **series)
+            os.replace(npz_path + tmp_suffix, npz_path)
+        with open(json_path + tmp_suffix, 'w') as entry_file:
+            json.dump(values, entry_file)
+        os.replace(json_path + tmp_suffix, json_path)
+
+        self._stores += 1
+        if self._stores % self.evict_interval == 0:
+            self.evict()
+
+    def entries(self):
+        """
+        Returns (last use time, json path) of every entry.
+        """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('.json'):
+                    entries.append((entry.stat().st_mtime, entry.path))
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used entries above max_entries.
+        """
+        entries = self.entries()
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort()
+        for _, json_path in entries[:len(entries) - self.max_entries]:
+            for path in (json_path, json_path[:-len('.json')] + '.npz'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        for _, json_path in self.entries():
+            for path in (json_path, json_path[:-len('.json')] + '.npz'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
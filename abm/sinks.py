@@ -0,0 +1,278 @@
+import abc
+import atexit
+import csv
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from abm.aggregate import CSV_COLUMNS, CSV_HEADER
+
+
+OUTPUT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'simulation_output'))
+
+# Where the aggregate results of every run are appended
+DEFAULT_OUTPUT_PATH = os.path.join(OUTPUT_DIR, 'aggregate_sim_data.csv')
+
+# Default output file of every backend
+DEFAULT_PATHS = {
+    "csv": DEFAULT_OUTPUT_PATH,
+    "sqlite": os.path.join(OUTPUT_DIR, 'aggregate_sim_data.sqlite'),
+    "parquet": os.path.join(OUTPUT_DIR, 'aggregate_sim_data.parquet'),
+}
+
+# Marks the end of the queue for the writer thread
+_CLOSE = object()
+
+
+class ResultsSink(abc.ABC):
+    """
+    Receives the AggregateRecords of finished runs and writes them from a single
+    background thread. emit() only puts the record on a bounded queue, the
+    writer takes records off it in batches of up to batch_size (or whatever
+    arrived within flush_interval seconds) and hands each batch to
+    write_batch() of the backend, so the runs never wait on file I/O unless
+    the queue is full.
+
+    Subclasses implement write_batch(records) and optionally open() and
+    close_output(), all three are only ever called from the writer thread.
+    """
+    def __init__(self, path, batch_size=64, flush_interval=1.0, max_queue=1024):
+
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"{type(self).__name__}-writer", daemon=True)
+        self._thread.start()
+
+    def open(self):
+        pass
+
+    @abc.abstractmethod
+    def write_batch(self, records):
+        pass
+
+    def close_output(self):
+        pass
+
+    def emit(self, record):
+        """
+        Queues a record for writing, blocks only while the queue is full.
+        """
+        if self._closed:
+            raise RuntimeError("emit() on a closed results sink")
+        self._raise_error()
+        self._queue.put(record)
+
+    def flush(self):
+        """
+        Blocks until every record emitted so far has been written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Writes the remaining records and closes the output.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"results sink failed writing to {self.path}") from error
+
+    def _next_batch(self):
+        """
+        Waits for a record, then collects up to batch_size of them. Returns the
+        batch and whether the close marker was reached.
+        """
+        first = self._queue.get()
+        if first is _CLOSE:
+            return [], True
+        batch = [first]
+        #the batch is written at most flush_interval after its first record
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        opened = False
+        done = False
+        while not done:
+            batch, done = self._next_batch()
+            try:
+                if batch and self._error is None:
+                    if not opened:
+                        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                        self.open()
+                        opened = True
+                    self.write_batch(batch)
+            except Exception as error:
+                #keep draining the queue so emit() and flush() do not hang,
+                #the error is raised in the emitting thread
+                self._error = error
+            finally:
+                for _ in range(len(batch) + done):
+                    self._queue.task_done()
+        if opened:
+            try:
+                self.close_output()
+            except Exception as error:
+                self._error = self._error or error
+
+
+class CSVSink(ResultsSink):
+    """
+    Appends the records to a csv file, aggregate_sim_data.csv by default. The
+    header is written once, when the file is new or empty.
+    """
+    def __init__(self, path=DEFAULT_PATHS["csv"], **kwargs):
+        self._file = None
+        self._writer = None
+        super().__init__(path, **kwargs)
+
+    def open(self):
+        write_header = not os.path.isfile(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, mode='a', newline='')
+        self._writer = csv.writer(self._file)
+        if write_header:
+            self._writer.writerow(CSV_HEADER)
+
+    def write_batch(self, records):
+        self._writer.writerows(record.csv_row() for record in records)
+        self._file.flush()
+
+    def close_output(self):
+        self._file.close()
+
+
+class SQLiteSink(ResultsSink):
+    """
+    Inserts the records into a table of a SQLite database, one column per
+    AggregateRecord field of CSV_COLUMNS. Every batch is one transaction.
+    """
+    def __init__(self, path=DEFAULT_PATHS["sqlite"], table="aggregate_sim_data", **kwargs):
+        self.table = table
+        self._connection = None
+        super().__init__(path, **kwargs)
+
+    def open(self):
+        #the connection belongs to the writer thread
+        self._connection = sqlite3.connect(self.path)
+        columns = ", ".join(name for name, _ in CSV_COLUMNS)
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({columns})")
+        self._connection.commit()
+
+    def write_batch(self, records):
+        placeholders = ", ".join("?" for _ in CSV_COLUMNS)
+        rows = [[_sql_value(value) for value in record.csv_row()] for record in records]
+        with self._connection:
+            self._connection.executemany(f"INSERT INTO {self.table} VALUES ({placeholders})", rows)
+
+    def close_output(self):
+        self._connection.close()
+
+
+class ParquetSink(ResultsSink):
+    """
+    Writes the records to a parquet file, one row group per batch. Needs
+    pyarrow, which is imported when the sink is created. A parquet file cannot
+    be appended to, an existing file at path is replaced.
+    """
+    def __init__(self, path=DEFAULT_PATHS["parquet"], **kwargs):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise ImportError("ParquetSink requires pyarrow, install it with `pip install pyarrow`") from error
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._schema = None
+        self._writer = None
+        super().__init__(path, **kwargs)
+
+    def open(self):
+        pa = self._pa
+        types = {"simulation_name": pa.string(), "run_number": pa.int64(), "prosumers": pa.int64(),
+                 "perfect_forecasting": pa.bool_(), "exchange_type": pa.string()}
+        #amm_liquidity_k is empty for bilateral runs, every other column is a float total
+        self._schema = pa.schema([(name, types.get(name, pa.float64())) for name, _ in CSV_COLUMNS])
+        self._writer = self._pq.ParquetWriter(self.path, self._schema)
+
+    def write_batch(self, records):
+        columns = {name: [_sql_value(getattr(record, name)) for record in records] for name, _ in CSV_COLUMNS}
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+
+    def close_output(self):
+        self._writer.close()
+
+
+SINKS = {
+    "csv": CSVSink,
+    "sqlite": SQLiteSink,
+    "parquet": ParquetSink,
+}
+
+
+def make_sink(kind="csv", path=None, **kwargs):
+    """
+    Creates a results sink.
+
+    INPUT:
+        kind (str): "csv", "sqlite" or "parquet"
+        path (str): output file, defaults to DEFAULT_PATHS[kind]
+        **kwargs: batch_size, flush_interval, max_queue
+    RETURN:
+        sink (ResultsSink)
+    """
+    if kind not in SINKS:
+        raise ValueError(f"unknown results sink {kind!r}, expected one of {sorted(SINKS)}")
+    return SINKS[kind](path or DEFAULT_PATHS[kind], **kwargs)
+
+
+_default_sink = None
+
+
+def default_sink():
+    """
+    Returns the process wide csv sink used by Markets that are not given one.
+    It is created on first use and closed when the interpreter exits.
+    """
+    global _default_sink
+    if _default_sink is None:
+        _default_sink = CSVSink()
+        atexit.register(_default_sink.close)
+    return _default_sink
+
+
+def _sql_value(value):
+    #numpy scalars and None amm_liquidity_k values
+    if value is None:
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
@@ -0,0 +1,119 @@
+import numpy as np
+
+
+# Memoized solar geometry, keyed by everything the geometry depends on.
+# The irradiance data does not enter the geometry, so every run in a sweep
+# (and every Market in the same process) shares one entry.
+_geometry_cache = {}
+
+
+def solar_noon_minutes(days, local_time_meridian, longitude, observe_daylight_savings=False):
+    """
+    Calculates the minute of the day at which solar noon occurs for every day
+    in days, e.g. 720 for a solar noon at 12 pm (see model_design.ipynb).
+
+    INPUT:
+        days (np arr): nth days of the year
+        local_time_meridian (float): local time meridian in degrees
+        longitude (float): longitude in degrees
+        observe_daylight_savings (bool): whether the location observes
+                                         daylight savings (days 69 - 307)
+
+    RETURN:
+        minutes (np arr of int): minute of the day at which solar noon occurs
+    """
+    days = np.asarray(days, dtype=float)
+
+    longitudeCorrection = 4.0 * (local_time_meridian - longitude)  # Units of minutes
+    Bradians = np.radians((360.0/364.0) * (days - 81))
+    E = (9.87 * np.sin(2 * Bradians)) - (7.53 * np.cos(Bradians)) - (1.5 * np.sin(Bradians))  # Units of minutes
+    minutesFromClockNoonInt = np.round(-longitudeCorrection - E).astype(int)
+
+    clock_noon = np.full(days.shape, 12 * 60)
+    if observe_daylight_savings:
+        clock_noon[(days >= 69) & (days <= 307)] = 13 * 60
+
+    return clock_noon + minutesFromClockNoonInt
+
+
+def solar_geometry(latitude, longitude, local_time_meridian, begin_month_day, days_in_month,
+                   observe_daylight_savings=False):
+    """
+    Computes the minutely solar geometry of a fixed-tilt array for a whole
+    month as array operations. The result is memoized, repeated calls with the
+    same arguments return the same (read-only) arrays.
+
+    INPUT:
+        latitude, longitude, local_time_meridian (float): location in degrees
+        begin_month_day (int): nth day of the year the month starts on
+        days_in_month (int): number of simulated days
+        observe_daylight_savings (bool): whether daylight savings is observed
+
+    RETURN:
+        geometry (dict of np arr): minutely "declination", "hour_angle",
+                                   "altitude", "azimuth", "incidence" (degrees)
+                                   and the diffuse sky factor "C"
+    """
+    key = (latitude, longitude, local_time_meridian, begin_month_day, days_in_month,
+           observe_daylight_savings)
+    geometry = _geometry_cache.get(key)
+    if geometry is not None:
+        return geometry
+
+    days = begin_month_day + np.arange(days_in_month)
+    minute_of_day = np.arange(1440) #minutes in one day = 60*24 = 1440
+
+    day_declination = 23.45 * np.sin(np.radians((360/365) * days))
+    day_C = 0.095 + (0.04 * np.sin(np.radians((360/365) * (days - 100))))
+    day_solar_noon = solar_noon_minutes(days, local_time_meridian, longitude, observe_daylight_savings)
+
+    # (days, minutes) grids flattened to one minutely axis
+    declination = np.repeat(day_declination, 1440)
+    C = np.repeat(day_C, 1440)
+    minutesFromSolarNoon = (day_solar_noon[:, None] - minute_of_day[None, :]).ravel()
+    hourAngle = (minutesFromSolarNoon / 60.0) * 15.0
+
+    lat = np.radians(latitude)
+    dec = np.radians(declination)
+    ha = np.radians(hourAngle)
+
+    # the clips guard against round-off pushing the arguments just outside [-1, 1]
+    altitudeAngle = np.degrees(np.arcsin(np.clip(
+        np.cos(lat) * np.cos(dec) * np.cos(ha) + (np.sin(lat) * np.sin(dec)), -1.0, 1.0)))
+    alt = np.radians(altitudeAngle)
+    solarAzimuth = np.degrees(np.arcsin(np.clip(
+        (np.cos(dec) * np.sin(ha)) / np.cos(alt), -1.0, 1.0)))
+    azi = np.radians(solarAzimuth)
+    incidenceAngle = np.degrees(np.arccos(np.clip(
+        np.cos(alt) * np.cos(azi) * np.sin(lat) + (np.sin(alt) * np.cos(lat)), -1.0, 1.0)))
+
+    geometry = {"declination": declination, "hour_angle": hourAngle, "altitude": altitudeAngle,
+                "azimuth": solarAzimuth, "incidence": incidenceAngle, "C": C}
+    for arr in geometry.values():
+        arr.setflags(write=False)
+
+    _geometry_cache[key] = geometry
+    return geometry
+
+
+def collector_radiation(irradiance, geometry, latitude):
+    """
+    Uses minutely irradiance and the solar geometry to calculate the radiation
+    received by a fixed-tilt solar panel (beam + diffuse + reflected).
+
+    INPUT:
+        irradiance (np arr): minutely solar irradiance for the month
+        geometry (dict): output of solar_geometry()
+        latitude (float): latitude in degrees
+
+    RETURN:
+        collectorRad (np arr): minutely collector radiation
+    """
+    irradiance = np.asarray(irradiance, dtype=float)
+    cos_lat = np.cos(np.radians(latitude))
+
+    beamRad = irradiance * np.cos(np.radians(geometry["incidence"]))
+    diffuseRad = irradiance * geometry["C"] * ((1 + cos_lat) / 2)
+    reflectedRad = irradiance * 0.2 * (geometry["C"] + np.sin(np.radians(geometry["altitude"]))) * ((1 - cos_lat) / 2)
+
+    return beamRad + diffuseRad + reflectedRad
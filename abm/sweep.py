@@ -0,0 +1,409 @@
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import traceback
+
+import numpy as np
+from scipy import stats
+
+from abm.aggregate import CSV_COLUMNS
+from abm.model import Market, SCENARIO_KEYS
+
+
+CONFIG_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'configurations'))
+
+# AggregateRecord fields whose confidence intervals decide when an adaptive
+# sweep stops running a configuration
+DEFAULT_METRICS = ("proportion_excess_sold", "seller_average_price")
+
+
+def load_household_params(prosumer_count, config_dir=CONFIG_DIR):
+    """
+    Loads the household params of configurations/household_params/prosumer{prosumer_count}.json
+    """
+    with open(os.path.join(config_dir, 'household_params', f'prosumer{prosumer_count}.json'), 'r') as config_file:
+        return json.load(config_file)["household_params"]
+
+
+def prepare_configs(config_dict_list, config_dir=CONFIG_DIR, crn_seed=None):
+    """
+    Returns copies of the configurations with their household params added, the
+    same way single_run.py and batch_run.py do it. With crn_seed, configurations
+    without a "seed" get it, so run n of every configuration uses the same
+    random streams (common random numbers, see Market.run_streams()).
+    """
+    household_params = {}
+    prepared = []
+    for config_dict in config_dict_list:
+        prosumer_count = config_dict["prosumer_count"]
+        if prosumer_count not in household_params:
+            household_params[prosumer_count] = load_household_params(prosumer_count, config_dir)
+
+        config_dict = dict(config_dict)
+        config_dict["household_params"] = household_params[prosumer_count]
+        if crn_seed is not None:
+            config_dict.setdefault("seed", crn_seed)
+        prepared.append(config_dict)
+    return prepared
+
+
+def expand_tasks(config_dict_list, config_dir=CONFIG_DIR, crn_seed=None):
+    """
+    Expands a list of configurations into one task per (configuration, run),
+    see prepare_configs().
+
+    RETURN:
+        tasks (list of tuple): (config_index, run_number, config_dict), ordered
+                               by (config_index, run_number)
+    """
+    tasks = []
+    for config_index, config_dict in enumerate(prepare_configs(config_dict_list, config_dir, crn_seed)):
+        for run_number in range(1, config_dict["n_runs"] + 1):
+            tasks.append((config_index, run_number, config_dict))
+    return tasks
+
+
+def expand_scenario_tasks(config_dict_list, config_dir=CONFIG_DIR, crn_seed=None):
+    """
+    Like expand_tasks(), but amm configurations that differ only in the
+    SCENARIO_KEYS (amm_liquidity_k, amm_transaction_fee) are grouped, and run n
+    of a group is one task that simulates all of its configurations at once,
+    see Market.run_scenarios(). Each group shares the random streams of its
+    first configuration, so unseeded configurations of a group see common
+    random numbers.
+
+    RETURN:
+        tasks (list of tuple): (config_indices, run_number, config_dicts), ordered
+                               by (group, run_number), groups by first configuration
+    """
+    groups = {}
+    for config_index, config_dict in enumerate(prepare_configs(config_dict_list, config_dir, crn_seed)):
+        if config_dict["exchange_type"] == "amm":
+            shared = {key: value for key, value in config_dict.items() if key not in SCENARIO_KEYS and key != "n_runs"}
+            group_key = json.dumps(shared, sort_keys=True, default=str)
+        else:
+            group_key = config_index
+        groups.setdefault(group_key, []).append((config_index, config_dict))
+
+    tasks = []
+    for members in groups.values():
+        for run_number in range(1, max(config_dict["n_runs"] for _, config_dict in members) + 1):
+            running = [(config_index, config_dict) for config_index, config_dict in members
+                       if run_number <= config_dict["n_runs"]]
+            tasks.append((tuple(config_index for config_index, _ in running), run_number,
+                          [config_dict for _, config_dict in running]))
+    return tasks
+
+
+def run_task(task, retries=1, quiet=True, cache=None):
+    """
+    Runs one (configuration, run) of a sweep. Exceptions are caught so a failing
+    run never takes the rest of the sweep down, and the run is retried up to
+    retries more times. With a RunCache, a cached result is returned without
+    simulating and fresh results are stored in it.
+
+    RETURN:
+        result (tuple): (config_index, run_number, record, error, attempts) where
+                        record is the run's AggregateRecord (None on failure)
+                        and error the traceback of the last failure (None on success).
+                        attempts is 0 for results served from the cache
+    """
+    config_index, run_number, config_dict = task
+    if cache is not None:
+        record = cache.get(config_dict, run_number)
+        if record is not None:
+            return config_index, run_number, record, None, 0
+
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            abm_model = Market(config_dict, run_number, write_output=False)
+            if quiet:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    record = abm_model.run_simulation()
+            else:
+                record = abm_model.run_simulation()
+            if cache is not None:
+                cache.put(config_dict, run_number, record)
+            return config_index, run_number, record, None, attempt
+        except Exception:
+            error = traceback.format_exc()
+    return config_index, run_number, None, error, retries + 1
+
+
+def run_scenario_task(task, retries=1, quiet=True, cache=None):
+    """
+    Runs run n of a group of configurations from expand_scenario_tasks() as a
+    single scenario simulation. Configurations found in the cache are not
+    simulated, a group of one is an ordinary run_task().
+
+    RETURN:
+        results (list of tuple): one run_task() result tuple per configuration
+    """
+    config_indices, run_number, config_dicts = task
+    if len(config_dicts) == 1:
+        return [run_task((config_indices[0], run_number, config_dicts[0]), retries, quiet, cache)]
+
+    results = {}
+    missing = []
+    for config_index, config_dict in zip(config_indices, config_dicts):
+        record = cache.get(config_dict, run_number) if cache is not None else None
+        if record is not None:
+            results[config_index] = (config_index, run_number, record, None, 0)
+        else:
+            missing.append((config_index, config_dict))
+
+    if missing:
+        scenarios = [{key: config_dict[key] for key in SCENARIO_KEYS if key in config_dict}
+                     for _, config_dict in missing]
+        error = None
+        for attempt in range(1, retries + 2):
+            try:
+                abm_model = Market(missing[0][1], run_number, write_output=False)
+                if quiet:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        records = abm_model.run_scenarios(scenarios)
+                else:
+                    records = abm_model.run_scenarios(scenarios)
+                for (config_index, config_dict), record in zip(missing, records):
+                    if cache is not None:
+                        cache.put(config_dict, run_number, record)
+                    results[config_index] = (config_index, run_number, record, None, attempt)
+                error = None
+                break
+            except Exception:
+                error = traceback.format_exc()
+        if error is not None:
+            for config_index, _ in missing:
+                results[config_index] = (config_index, run_number, None, error, retries + 1)
+
+    return [results[config_index] for config_index in config_indices]
+
+
+class _TaskRunner:
+    """
+    Picklable wrapper around run_task() / run_scenario_task() for the worker processes.
+    """
+    def __init__(self, retries, quiet, cache, scenarios=False):
+        self.retries = retries
+        self.quiet = quiet
+        self.cache = cache
+        self.scenarios = scenarios
+
+    def __call__(self, task):
+        if self.scenarios:
+            return run_scenario_task(task, self.retries, self.quiet, self.cache)
+        return run_task(task, self.retries, self.quiet, self.cache)
+
+
+def _init_worker():
+    # forked workers inherit the parent's random state, reseed so the
+    # forecast noise and amm bid order differ between workers
+    random.seed()
+    np.random.seed()
+
+
+def make_pool(workers=None):
+    """
+    Returns a pool of worker processes for run_task(), or None when workers
+    is 1 and the runs should execute in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    return multiprocessing.Pool(processes=workers, initializer=_init_worker)
+
+
+def run_sweep(config_dict_list, workers=None, chunksize=1, retries=1, quiet=True, on_result=None, cache=None,
+              crn_seed=None, scenarios=False):
+    """
+    Runs every (configuration, run) of a sweep on a pool of worker processes.
+    Results stream back to the parent in (configuration, run_number) order as
+    soon as they are ready, so a single writer in the parent can consume them.
+    With scenarios, amm configurations that differ only in amm_liquidity_k or
+    amm_transaction_fee share one simulation per run (see
+    expand_scenario_tasks()) and results come back ordered by group instead.
+
+    INPUT:
+        config_dict_list (list of dict): configurations, as in batch_run.json
+        workers (int): number of worker processes, defaults to the number of
+                       cores. With 1 the runs execute in this process.
+        chunksize (int): number of tasks handed to a worker at a time
+        retries (int): how many times a failing run is retried
+        quiet (bool): silence the model's prints inside the runs
+        on_result (callable): called with each result tuple of run_task(), in order
+        cache (RunCache): results cache, runs found in it are not simulated again
+        crn_seed (int): common random numbers seed for configurations without a "seed"
+        scenarios (bool): batch the pool scenarios of a configuration group
+
+    RETURN:
+        failures (list of tuple): result tuples of the runs that failed every attempt
+    """
+    if scenarios:
+        tasks = expand_scenario_tasks(config_dict_list, crn_seed=crn_seed)
+    else:
+        tasks = expand_tasks(config_dict_list, crn_seed=crn_seed)
+    runner = _TaskRunner(retries, quiet, cache, scenarios)
+
+    failures = []
+
+    def consume(results):
+        for task_results in results:
+            for result in (task_results if scenarios else [task_results]):
+                if result[2] is None:
+                    failures.append(result)
+                if on_result is not None:
+                    on_result(result)
+
+    pool = make_pool(workers)
+    try:
+        consume(map(runner, tasks) if pool is None else pool.imap(runner, tasks, chunksize=chunksize))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            #every worker stores into its own copy of the cache, whose store
+            #counter rarely reaches evict_interval, max_entries is enforced here
+            cache.evict()
+
+    return failures
+
+
+def metric_field(metric):
+    """
+    Returns the AggregateRecord field of a metric given by its field name or
+    its csv column name, e.g. "Seller Average Price".
+    """
+    fields = {column: name for name, column in CSV_COLUMNS}
+    if metric in fields.values():
+        return metric
+    if metric in fields:
+        return fields[metric]
+    raise ValueError(f"unknown metric {metric!r}, expected an aggregate record field or csv column")
+
+
+def ci_half_width(values, confidence=0.95):
+    """
+    Half-width of the Student t confidence interval of the mean of values.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) < 2:
+        return np.inf
+    t_value = stats.t.ppf(0.5 + confidence / 2, len(values) - 1)
+    return t_value * np.std(values, ddof=1) / np.sqrt(len(values))
+
+
+def has_converged(records, metrics=DEFAULT_METRICS, rel_half_width=0.02, confidence=0.95):
+    """
+    True once the confidence interval half-width of every metric is within
+    rel_half_width of the metric's mean (or zero, for runs without variance).
+    Metrics are record fields or csv column names, see metric_field().
+
+    RETURN:
+        converged (bool), half_widths (dict): {metric: half-width}
+    """
+    half_widths = {}
+    converged = True
+    for metric in metrics:
+        values = np.array([getattr(record, metric_field(metric)) for record in records], dtype=float)
+        #runs without a value (e.g. no seller average price when nothing was
+        #sold) do not count, a metric no run has a value for cannot converge further
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            half_widths[metric] = np.nan
+            continue
+        half_width = ci_half_width(values, confidence)
+        half_widths[metric] = half_width
+        if not half_width <= rel_half_width * abs(np.mean(values)):
+            converged = False
+    return converged, half_widths
+
+
+def check_adaptive_params(min_runs, step):
+    """
+    Raises ValueError unless min_runs >= 2, the fewest runs a confidence
+    interval needs, and step >= 1, so every wave brings a configuration
+    closer to n_runs.
+    """
+    if min_runs < 2:
+        raise ValueError(f"min_runs must be at least 2, got {min_runs}")
+    if step < 1:
+        raise ValueError(f"step must be at least 1, got {step}")
+
+
+def run_adaptive_sweep(config_dict_list, workers=None, chunksize=1, retries=1, quiet=True, on_result=None,
+                       cache=None, crn_seed=None, min_runs=3, step=2, metrics=DEFAULT_METRICS,
+                       rel_half_width=0.02, confidence=0.95):
+    """
+    Runs every configuration until its metrics have converged instead of a
+    fixed n_runs times. Each configuration first gets min_runs runs, then
+    waves of step more runs until the confidence interval half-width of every
+    metric is within rel_half_width of its mean, or n_runs is reached. The
+    runs of all unconverged configurations in a wave share the worker pool.
+
+    INPUT:
+        see run_sweep(), and
+        min_runs (int): runs before convergence is first checked, at least 2
+        step (int): runs added to an unconverged configuration per wave, at least 1
+        metrics (tuple of str): AggregateRecord fields that have to converge
+        rel_half_width (float): target half-width, relative to the mean
+        confidence (float): confidence level of the intervals
+
+    RETURN:
+        failures (list of tuple): result tuples of the runs that failed every attempt
+        summary (list of dict): per configuration, the runs used, whether it
+                                converged and the final half-widths
+    """
+    check_adaptive_params(min_runs, step)
+    for metric in metrics:
+        metric_field(metric)
+    configs = prepare_configs(config_dict_list, crn_seed=crn_seed)
+    runner = _TaskRunner(retries, quiet, cache)
+
+    records = [[] for _ in configs]
+    runs_started = [0] * len(configs)
+    summary = [{"runs": 0, "converged": False, "half_widths": {}} for _ in configs]
+    active = set(range(len(configs)))
+    failures = []
+
+    pool = make_pool(workers)
+    try:
+        while active:
+            tasks = []
+            for config_index in sorted(active):
+                config_dict = configs[config_index]
+                wave = min_runs if runs_started[config_index] == 0 else step
+                wave = min(wave, config_dict["n_runs"] - runs_started[config_index])
+                for run_number in range(runs_started[config_index] + 1, runs_started[config_index] + wave + 1):
+                    tasks.append((config_index, run_number, config_dict))
+                runs_started[config_index] += wave
+
+            results = map(runner, tasks) if pool is None else pool.imap(runner, tasks, chunksize=chunksize)
+            for result in results:
+                if result[2] is None:
+                    failures.append(result)
+                else:
+                    records[result[0]].append(result[2])
+                if on_result is not None:
+                    on_result(result)
+
+            for config_index in sorted(active):
+                converged, half_widths = has_converged(records[config_index], metrics, rel_half_width, confidence)
+                summary[config_index].update(runs=runs_started[config_index], converged=converged,
+                                             half_widths=half_widths)
+                if converged or runs_started[config_index] >= configs[config_index]["n_runs"]:
+                    active.discard(config_index)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            #every worker stores into its own copy of the cache, whose store
+            #counter rarely reaches evict_interval, max_entries is enforced here
+            cache.evict()
+
+    return failures, summary
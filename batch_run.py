@@ -1,29 +1,90 @@
-from abm.model import Market
-import json 
+from abm.sweep import run_sweep, run_adaptive_sweep, check_adaptive_params, DEFAULT_METRICS
+from abm.sinks import make_sink, SINKS
+from abm.runcache import RunCache, DEFAULT_CACHE_DIR
+import argparse
+import json
+import os
 
 
 
 if __name__ == "__main__":
 
-    # Loading the simulation configuration information 
-    config_dict = {} 
-    file_path = "configurations/batch_run.json" 
+    parser = argparse.ArgumentParser(description="Runs every configuration of a batch run file")
+    parser.add_argument("--config", default="configurations/batch_run.json", help="batch run configuration file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes, 1 runs everything in this process")
+    parser.add_argument("--chunksize", type=int, default=1, help="number of runs handed to a worker at a time")
+    parser.add_argument("--retries", type=int, default=1, help="how many times a failing run is retried")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the run results cache")
+    parser.add_argument("--no-cache", action="store_true", help="simulate every run even if its result is cached")
+    parser.add_argument("--crn-seed", type=int, default=None,
+                        help="common random numbers: run n of every configuration without a seed uses the same random streams")
+    parser.add_argument("--sink", choices=sorted(SINKS), default="csv", help="format the aggregate results are written in")
+    parser.add_argument("--output", default=None, help="results file, defaults to simulation_output/aggregate_sim_data.<format>")
+    parser.add_argument("--equilibrium-cache", action="store_true",
+                        help="amm runs read the k independent equilibrium prices from simulation_output/equilibrium_cache")
+    parser.add_argument("--scenarios", action="store_true",
+                        help="amm configurations that differ only in amm_liquidity_k / amm_transaction_fee share one simulation per run")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="stop running a configuration once its metrics have converged, n_runs becomes a cap")
+    parser.add_argument("--min-runs", type=int, default=3, help="adaptive: runs before convergence is first checked, at least 2")
+    parser.add_argument("--step", type=int, default=2, help="adaptive: runs added to an unconverged configuration at a time, at least 1")
+    parser.add_argument("--metric", action="append", dest="metrics", default=None,
+                        help=f"adaptive: record field or csv column that has to converge, repeatable (default {list(DEFAULT_METRICS)})")
+    parser.add_argument("--rel-half-width", type=float, default=0.02,
+                        help="adaptive: target confidence interval half-width, relative to the metric's mean")
+    parser.add_argument("--confidence", type=float, default=0.95, help="adaptive: confidence level of the intervals")
+    args = parser.parse_args()
+    if args.adaptive:
+        #fail before the results file is opened
+        check_adaptive_params(args.min_runs, args.step)
 
-    with open(file_path, 'r') as config_file:
+    #Runs whose configuration, household params, input data, seed and model
+    #version are unchanged are read from the cache instead of simulated
+    cache = None if args.no_cache else RunCache(args.cache_dir)
+
+    # Loading the simulation configuration information
+    with open(args.config, 'r') as config_file:
         config_dict_list = json.load(config_file)
-    
-    #There are a list of configurations that we are running 
-    for config_dict in config_dict_list:
-        prosumer_count = config_dict["prosumer_count"]
-        #Imports the relevant household param json file from configurations/household_params/ folder
-        #adds that to the config_dict and passes the rest to the Market class
-        with open(f"configurations/household_params/prosumer{prosumer_count}.json", 'r') as config_file:
-            household_params = json.load(config_file)
-        
-        config_dict["household_params"] = household_params["household_params"]
-        num_runs = config_dict["n_runs"] #number of times we run the same configuration
-        
-        #for multirun simulation, 
-        for run_number in range(1, num_runs + 1): 
-            abm_model = Market(config_dict,run_number)
-            abm_model.run_simulation()
\ No newline at end of file
+    if args.equilibrium_cache:
+        for config_dict in config_dict_list:
+            config_dict.setdefault("equilibrium_cache", True)
+
+    #Every configuration is run n_runs times, the runs are spread over the
+    #worker processes and the household params are added per prosumer_count.
+    #Results come back in (configuration, run_number) order and the sink's
+    #writer thread in this process is the only one writing the results file
+    sink = make_sink(args.sink, args.output)
+
+    def write_result(result):
+        config_index, run_number, record, error, attempts = result
+        if record is not None:
+            sink.emit(record)
+            status = "cached" if attempts == 0 else "done"
+            print(f"config {config_index} run {run_number}: {status} ({record.simulation_name})")
+        else:
+            print(f"config {config_index} run {run_number}: FAILED after {attempts} attempts\n{error}")
+
+    with sink:
+        if args.adaptive:
+            #Runs every configuration in waves until the confidence intervals
+            #of the metrics are narrow enough, at most n_runs times
+            failures, summary = run_adaptive_sweep(config_dict_list, workers=args.workers, chunksize=args.chunksize,
+                                                   retries=args.retries, on_result=write_result, cache=cache,
+                                                   crn_seed=args.crn_seed, min_runs=args.min_runs, step=args.step,
+                                                   metrics=tuple(args.metrics or DEFAULT_METRICS),
+                                                   rel_half_width=args.rel_half_width, confidence=args.confidence)
+        else:
+            failures = run_sweep(config_dict_list, workers=args.workers, chunksize=args.chunksize,
+                                 retries=args.retries, on_result=write_result, cache=cache,
+                                 crn_seed=args.crn_seed, scenarios=args.scenarios)
+            summary = None
+
+    if summary is not None:
+        for config_index, config_summary in enumerate(summary):
+            status = "converged" if config_summary["converged"] else "not converged"
+            half_widths = ", ".join(f"{metric} ±{half_width:.4g}" for metric, half_width in config_summary["half_widths"].items())
+            print(f"config {config_index}: {status} after {config_summary['runs']} of "
+                  f"{config_dict_list[config_index]['n_runs']} runs ({half_widths})")
+
+    if failures:
+        print(f"{len(failures)} runs failed: {[(f[0], f[1]) for f in failures]}")
@@ -0,0 +1,51 @@
+from abm.ksearch import search_liquidity
+from abm.sinks import make_sink, SINKS
+from abm.runcache import RunCache, DEFAULT_CACHE_DIR
+import argparse
+import os
+
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Searches the amm_liquidity_k that optimizes an aggregate metric, per prosumer count")
+    parser.add_argument("--prosumers", type=int, nargs="+", default=[1], help="prosumer counts to search k for")
+    parser.add_argument("--imperfect-forecasting", action="store_true", help="search with forecast noise instead of perfect forecasting")
+    parser.add_argument("--objective", default="total_production_for_market", help="aggregate record field or csv column to optimize")
+    parser.add_argument("--minimize", action="store_true", help="minimize the objective instead of maximizing it")
+    parser.add_argument("--k-min", type=float, default=10, help="lowest k searched")
+    parser.add_argument("--k-max", type=float, default=1000, help="highest k searched")
+    parser.add_argument("--k-tolerance", type=float, default=0.05, help="stop once the bracket's highest k is within this fraction of its lowest")
+    parser.add_argument("--runs", type=int, default=4, help="runs per k and comparison step")
+    parser.add_argument("--max-runs", type=int, default=16, help="most runs of a k when two ks are hard to tell apart")
+    parser.add_argument("--seed", type=int, default=0, help="seed shared by the runs of every k (common random numbers)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes, 1 runs everything in this process")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="directory of the run results cache")
+    parser.add_argument("--no-cache", action="store_true", help="simulate every run even if its result is cached")
+    parser.add_argument("--sink", choices=sorted(SINKS), default=None, help="also write the records of the runs in this format")
+    parser.add_argument("--output", default=None, help="results file, defaults to simulation_output/aggregate_sim_data.<format>")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else RunCache(args.cache_dir)
+    sink = make_sink(args.sink, args.output) if args.sink else None
+
+    def write_result(result):
+        if sink is not None and result[2] is not None:
+            sink.emit(result[2])
+
+    try:
+        for prosumer_count in args.prosumers:
+            config_dict = {"prosumer_count": prosumer_count, "perfect_forecasting": not args.imperfect_forecasting,
+                           "exchange_type": "amm"}
+            result = search_liquidity(config_dict, objective=args.objective, maximize=not args.minimize,
+                                      k_bounds=(args.k_min, args.k_max), k_tolerance=args.k_tolerance,
+                                      runs=args.runs, max_runs=args.max_runs,
+                                      seed=args.seed, workers=args.workers, cache=cache, on_result=write_result)
+
+            print(f"prosumers {prosumer_count}: best k {result['k']}, {args.objective} {result['objective']:.6g} "
+                  f"({result['simulated_runs']} runs simulated)")
+            for k, (value, n_runs) in result["evaluations"].items():
+                print(f"    k {k}: {value:.6g} over {n_runs} runs")
+    finally:
+        if sink is not None:
+            sink.close()
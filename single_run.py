@@ -1,4 +1,8 @@
-from abm.model import Market
+from abm.model import Market, simulation_name
+from abm.sinks import CSVSink
+from abm.recorder import TimestepRecorder
+from abm.orderflow import OrderFlowWriter
+import os
 import json 
 
 
@@ -21,7 +25,18 @@ if __name__ == "__main__":
     config_dict["household_params"] = household_params["household_params"]
     num_runs = config_dict["n_runs"] #number of times we run the same configuration
     
-    #for multirun simulation, 
-    for run_number in range(1, num_runs + 1): 
-        abm_model = Market(config_dict,run_number)
-        abm_model.run_simulation()
\ No newline at end of file
+    #for multirun simulation, the sink appends every run's totals to simulation_output/aggregate_sim_data.csv
+    with CSVSink() as sink:
+        for run_number in range(1, num_runs + 1): 
+            #optional per timestep traces, set "record_dir" in the config to keep them
+            recorder = None
+            if config_dict.get("record_dir"):
+                record_path = os.path.join(config_dict["record_dir"], f"{simulation_name(config_dict)}_run{run_number}")
+                recorder = TimestepRecorder(record_path, len(config_dict["household_params"]))
+            #optional amm order flow capture, set "orderflow_dir" in the config to replay it with abm.orderflow
+            orderflow = None
+            if config_dict.get("orderflow_dir") and config_dict["exchange_type"] == "amm":
+                orderflow_path = os.path.join(config_dict["orderflow_dir"], f"{simulation_name(config_dict)}_run{run_number}.npz")
+                orderflow = OrderFlowWriter(orderflow_path, config_dict, run_number)
+            abm_model = Market(config_dict,run_number, sink=sink, recorder=recorder, orderflow=orderflow)
+            abm_model.run_simulation()
@@ -0,0 +1,24 @@
+import pytest
+
+from abm.ksearch import search_liquidity
+
+
+def test_degenerate_bracket_evaluates_endpoints():
+    #the bracket is within k_tolerance, the golden-section loop never steps
+    result = search_liquidity({"prosumer_count": 2, "perfect_forecasting": True}, k_bounds=(100, 104),
+                              runs=2, max_runs=2, workers=1)
+    assert result["k"] in (100, 104)
+    assert set(result["evaluations"]) == {100, 104}
+
+
+def test_collapsed_bracket_evaluates_one_k():
+    result = search_liquidity({"prosumer_count": 2, "perfect_forecasting": True}, k_bounds=(100, 100.01),
+                              runs=2, max_runs=2, workers=1)
+    assert result["k"] == 100
+    assert result["evaluations"][100][1] == 2
+
+
+@pytest.mark.parametrize("k_bounds", [(100, 100), (200, 100), (0, 100)])
+def test_invalid_bounds(k_bounds):
+    with pytest.raises(ValueError):
+        search_liquidity({"prosumer_count": 2, "perfect_forecasting": True}, k_bounds=k_bounds, workers=1)
@@ -0,0 +1,19 @@
+from abm.runcache import RunCache
+from abm.sweep import run_sweep
+
+
+def test_multi_worker_sweep_keeps_max_entries(tmp_path):
+    cache = RunCache(str(tmp_path), max_entries=2)
+    config_dict_list = [{"prosumer_count": 2, "perfect_forecasting": True, "exchange_type": "amm",
+                         "amm_liquidity_k": k, "n_runs": 3, "seed": 1} for k in (10, 100)]
+    failures = run_sweep(config_dict_list, workers=2, cache=cache)
+    assert not failures
+    assert len(cache.entries()) == 2
+
+
+def test_unseeded_amm_runs_are_not_cached(tmp_path):
+    cache = RunCache(str(tmp_path))
+    config_dict_list = [{"prosumer_count": 2, "perfect_forecasting": True, "exchange_type": "amm",
+                         "amm_liquidity_k": 100, "n_runs": 2}]
+    run_sweep(config_dict_list, workers=1, cache=cache)
+    assert cache.entries() == []